@@ -0,0 +1,4 @@
+import sys
+
+# the async def syntax needs python 3.5
+collect_ignore = ['test_async_timers.py'] if sys.version_info < (3, 5) else []
@@ -0,0 +1,90 @@
+import json
+import asyncio
+
+from voidpp_tools.cache import FileCacheHub
+from voidpp_tools.job_delayer import AsyncJobDelayer
+from voidpp_tools.timer import AsyncTimer
+
+def run(coroutine_function):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine_function(loop))
+    finally:
+        loop.close()
+
+
+def test_async_delayer_debounce():
+    calls = []
+
+    async def main(loop):
+        fired = asyncio.Future(loop = loop)
+        delayer = AsyncJobDelayer(lambda: calls.append(loop.time()) or fired.set_result(None), 0.5, loop = loop)
+        for _ in range(3):
+            delayer.start()
+            last_start = loop.time()
+            await asyncio.sleep(0.01)
+        assert calls == []
+        await asyncio.wait_for(fired, 5)
+        return last_start
+
+    last_start = run(main)
+
+    assert len(calls) == 1
+    assert calls[0] - last_start >= 0.5
+
+
+def test_async_delayer_coroutine_job_and_max_delay():
+    calls = []
+
+    async def job():
+        calls.append(1)
+
+    async def main(loop):
+        delayer = AsyncJobDelayer(job, 0.02, max_delay = 0.05, loop = loop)
+        for _ in range(10):
+            delayer.start()
+            await asyncio.sleep(0.01)
+        delayer.cancel()
+
+    run(main)
+
+    # fired by the max_delay despite the continuous starts
+    assert 1 <= len(calls) <= 2
+
+
+def test_async_timer():
+    calls = []
+
+    async def callback():
+        calls.append(1)
+        await asyncio.sleep(0.015)
+
+    async def main(loop):
+        timer = AsyncTimer(0.01, callback, loop)
+        timer.start()
+        await asyncio.sleep(0.055)
+        timer.stop()
+        await asyncio.sleep(0.02)
+        return timer
+
+    timer = run(main)
+
+    # every second tick is skipped while the previous task is running
+    assert 2 <= len(calls) <= 3
+    assert timer.overrun_count >= 2
+    assert not timer.is_running()
+
+
+def test_cache_hub_with_event_loop(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+
+    async def main(loop):
+        hub = FileCacheHub(path, 0.01, loop = loop)
+        hub.save_node_data('node1', [1])
+        hub.save_node_data('node2', [2])
+        await asyncio.sleep(0.03)
+
+    run(main)
+
+    with open(path) as f:
+        assert json.load(f) == {'node1': [1], 'node2': [2]}
@@ -0,0 +1,73 @@
+import json
+
+from voidpp_tools.cache import FileCacheHub, DictCacheNode, ListCacheNode
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def create_hub(tmpdir):
+    tmpdir.join('cache.json').write('{}')
+    return FileCacheHub(str(tmpdir.join('cache.json')), 0, journal = True, compact_ratio = 100)
+
+
+def test_dict_node_saves_only_the_changed_key(tmpdir):
+    node = DictCacheNode('node', create_hub(tmpdir))
+
+    node['a'] = 1
+    node.update(b = [2])
+
+    # the first record is the creation of the node
+    assert read_lines(str(tmpdir.join('cache.json.journal'))) == [['node', {'a': 1}], ['node.a', 1], ['node.b', [2]]]
+
+
+def test_dict_node_delete_saves_the_node(tmpdir):
+    node = DictCacheNode('node', create_hub(tmpdir), {'a': 1, 'b': 2})
+
+    del node['a']
+
+    assert read_lines(str(tmpdir.join('cache.json.journal'))) == [['node', {'b': 2}]]
+
+
+def test_list_node_append_and_set(tmpdir):
+    hub = create_hub(tmpdir)
+    node = ListCacheNode('node', hub)
+
+    node.append(1)
+    node.append(2)
+    node[0] = 3
+    node.insert(0, 4)
+
+    assert read_lines(str(tmpdir.join('cache.json.journal'))) == [['node', [1]], ['node.0', 1], ['node.1', 2],
+                                                                  ['node.0', 3], ['node', [4, 3, 2]]]
+
+
+def test_container_nodes_replay(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub = create_hub(tmpdir)
+    items = ListCacheNode('items', hub)
+    items.append({'a': 1})
+    items.append(2)
+    settings = DictCacheNode('settings', hub)
+    settings['answer'] = 42
+
+    hub = FileCacheHub(path, 0, journal = True)
+
+    assert hub.get_node_data() == {'items': [{'a': 1}, 2], 'settings': {'answer': 42}}
+
+
+def test_list_node_set_after_append_replay(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write('{}')
+    hub = FileCacheHub(path, 10, journal = True, compact_ratio = 100)
+    node = ListCacheNode('node', hub, [1, 2, 3])
+    hub.flush()
+
+    node.append(10)
+    node.append(11)
+    node[3] = 99
+    hub.flush()
+
+    assert read_lines(str(tmpdir.join('cache.json.journal')))[-1] == ['node', [1, 2, 3, 99, 11]]
+    assert FileCacheHub(path, 0, journal = True).get_node_data('node') == [1, 2, 3, 99, 11]
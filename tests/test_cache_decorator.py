@@ -0,0 +1,72 @@
+import time
+from threading import Thread
+
+from voidpp_tools.cache import FileCacheHub, cached
+
+def test_cached_result_survives_restart(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    calls = []
+
+    def add(a, b = 0):
+        calls.append((a, b))
+        return a + b
+
+    assert cached(FileCacheHub(path, 0), path = 'add')(add)(1, b = 2) == 3
+    cached_add = cached(FileCacheHub(path, 0), path = 'add')(add)
+
+    assert cached_add(1, b = 2) == 3
+    assert cached_add(2) == 2
+    assert calls == [(1, 2), (2, 0)]
+    assert cached_add.cache_info().hits == 1
+    assert cached_add.cache_info().misses == 1
+
+
+def test_cached_none_result(tmpdir):
+    calls = []
+
+    @cached(FileCacheHub(str(tmpdir.join('cache.json')), 0))
+    def nothing():
+        calls.append(1)
+
+    nothing()
+    nothing()
+
+    assert calls == [1]
+
+
+def test_cached_concurrent_calls_run_once(tmpdir):
+    calls = []
+
+    @cached(FileCacheHub(str(tmpdir.join('cache.json')), 0))
+    def slow(value):
+        calls.append(value)
+        time.sleep(0.1)
+        return value * 2
+
+    results = []
+    threads = [Thread(target = lambda: results.append(slow(21))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [21]
+    assert results == [42] * 5
+
+
+def test_cached_skips_the_not_encodable_result(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub = FileCacheHub(path, 0)
+    calls = []
+
+    @cached(hub)
+    def tags():
+        calls.append(1)
+        return {'a', 'b'}
+
+    assert tags() == {'a', 'b'}
+    assert tags() == {'a', 'b'}
+    hub.save_node_data('other', 42)
+
+    assert len(calls) == 2
+    assert FileCacheHub(path, 0).get_node_data('other') == 42
@@ -0,0 +1,83 @@
+import json
+import os
+
+from voidpp_tools.cache import FileCacheHub
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_journal_appends_only_the_saved_node(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write('{}')
+    hub = FileCacheHub(path, 0, journal = True, compact_ratio = 100)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node2.sub', [1, 2])
+
+    assert read_lines(path + '.journal') == [['node1', {'a': 1}], ['node2.sub', [1, 2]]]
+
+
+def test_journal_first_write_creates_the_snapshot(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub = FileCacheHub(path, 0, journal = True, compact_ratio = 100)
+    hub.save_node_data('node1', {'a': 1})
+
+    with open(path) as f:
+        assert json.load(f) == {'node1': {'a': 1}}
+
+
+def test_journal_replay_on_load(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub = FileCacheHub(path, 0, journal = True, compact_ratio = 100)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node1.a', 2)
+    hub.save_node_data('node2', [42])
+
+    hub = FileCacheHub(path, 0, journal = True)
+
+    assert hub.get_node_data('node1') == {'a': 2}
+    assert hub.get_node_data('node2') == [42]
+
+
+def test_journal_compaction(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub = FileCacheHub(path, 0, journal = True, compact_ratio = 100)
+    hub.save_node_data('node1', {'a': 1})
+
+    hub.compact()
+
+    assert os.path.getsize(path + '.journal') == 0
+    with open(path) as f:
+        assert json.load(f) == {'node1': {'a': 1}}
+    assert FileCacheHub(path, 0, journal = True).get_node_data('node1') == {'a': 1}
+
+
+def test_journal_drops_broken_tail(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write('{}')
+    tmpdir.join('cache.json.journal').write('["node1",[1]]\n["node2",[')
+
+    hub = FileCacheHub(path, 0, journal = True, compact_ratio = 100)
+    hub.save_node_data('node3', [3])
+
+    hub = FileCacheHub(path, 0, journal = True)
+
+    assert hub.get_node_data('node1') == [1]
+    assert hub.get_node_data('node2') is None
+    assert hub.get_node_data('node3') == [3]
+
+
+def test_journal_skips_broken_record_in_the_middle(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write('{}')
+    tmpdir.join('cache.json.journal').write('["node1",[1]]\n["node2",[\n["node3",[3]]\n')
+
+    hub = FileCacheHub(path, 0, journal = True)
+
+    assert hub.get_node_data('node1') == [1]
+    assert hub.get_node_data('node2') is None
+    assert hub.get_node_data('node3') == [3]
+    # not a torn tail, the journal is kept
+    with open(path + '.journal') as f:
+        assert len(f.readlines()) == 3
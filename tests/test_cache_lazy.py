@@ -0,0 +1,63 @@
+import json
+import os
+
+from voidpp_tools.cache import FileCacheHub
+
+def create_indexed_cache(path):
+    hub = FileCacheHub(path, 0, lazy = True)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node2', [1, 2, 3])
+    hub.save_node_data('node3', 'teve')
+
+
+def test_lazy_file_is_plain_json(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+
+    create_indexed_cache(path)
+
+    with open(path) as f:
+        assert json.load(f) == {'node1': {'a': 1}, 'node2': [1, 2, 3], 'node3': 'teve'}
+
+
+def test_lazy_decodes_only_the_requested_node(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    create_indexed_cache(path)
+
+    hub = FileCacheHub(path, 0, lazy = True)
+
+    assert hub.get_node_data('node1.a') == 1
+    assert list(hub._data) == ['node1']
+
+
+def test_lazy_writes_back_the_untouched_nodes(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    create_indexed_cache(path)
+
+    hub = FileCacheHub(path, 0, lazy = True)
+    hub.save_node_data('node2', [4])
+    hub = FileCacheHub(path, 0, lazy = True)
+
+    assert hub.get_node_data() == {'node1': {'a': 1}, 'node2': [4], 'node3': 'teve'}
+
+
+def test_lazy_falls_back_to_full_load_with_stale_index(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    create_indexed_cache(path)
+    with open(path, 'w') as f:
+        f.write('{"node1": 42}')
+
+    hub = FileCacheHub(path, 0, lazy = True)
+
+    assert hub.get_node_data('node1') == 42
+
+
+def test_lazy_sharded(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 0, sharded = True)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node2', [1])
+
+    hub = FileCacheHub(path, 0, sharded = True, lazy = True)
+
+    assert hub.get_node_data('node2') == [1]
+    assert list(hub._data) == ['node2']
@@ -0,0 +1,80 @@
+import json
+
+from voidpp_tools.compat import mock
+from voidpp_tools.cache import FileCacheHub, LRUCacheNode
+
+def test_lru_evicts_the_least_recently_used(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0)
+    node = LRUCacheNode('lru', hub, max_entries = 2)
+    node.set('a', 1)
+    node.set('b', 2)
+    node.get('a')
+
+    node.set('c', 3)
+
+    assert 'b' not in node
+    assert node.get('a') == 1
+    assert node.get('c') == 3
+
+
+def test_lru_max_bytes(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0)
+    node = LRUCacheNode('lru', hub, max_bytes = 12)
+    node.set('a', 'xxx')
+    node.set('b', 'yyy')
+
+    node.set('c', 'zzz')
+
+    assert len(node) == 2
+    assert 'a' not in node
+
+
+def test_lru_ttl(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0)
+    node = LRUCacheNode('lru', hub, ttl = 10)
+
+    with mock.patch('time.time', return_value = 100):
+        node.set('a', 1)
+        node.set('b', 2, ttl = 100)
+
+    with mock.patch('time.time', return_value = 120):
+        assert node.get('a') is None
+        assert node.get('b') == 2
+        node.set('c', 3, ttl = 1)
+
+    with mock.patch('time.time', return_value = 130):
+        assert node.sweep() == 1
+
+    assert len(node) == 1
+
+
+def test_lru_persists_the_recency_order(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    node = LRUCacheNode('lru', FileCacheHub(path, 0), max_entries = 3)
+    node.set('a', 1)
+    node.set('b', 2)
+    node.set('c', 3)
+    node.get('a')
+    node.set('d', 4)
+
+    with open(path) as f:
+        assert list(json.load(f)['lru']) == ['c', 'a', 'd']
+
+    node = LRUCacheNode('lru', FileCacheHub(path, 0), max_entries = 3)
+    node.set('e', 5)
+
+    assert 'c' not in node
+    assert node.get('a') == 1
+
+
+def test_lru_hit_does_not_write(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0)
+    node = LRUCacheNode('lru', hub)
+    node.set('a', 1)
+    node.set('b', 2)
+
+    with mock.patch.object(hub, 'save_node_data') as save_node_data:
+        assert node.get('a') == 1
+        assert node.get('b') == 2
+
+    assert not save_node_data.called
@@ -0,0 +1,78 @@
+import json
+
+from voidpp_tools.cache import DictCacheNode, FileCacheHub, ListCacheNode
+
+def test_multiprocess_merges_the_changes_of_other_writers(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub1 = FileCacheHub(path, 0, multiprocess = True)
+    hub2 = FileCacheHub(path, 0, multiprocess = True)
+
+    hub1.save_node_data('node1', {'a': 1})
+    hub2.save_node_data('node2', [2])
+
+    with open(path) as f:
+        assert json.load(f) == {'node1': {'a': 1}, 'node2': [2]}
+    assert hub2.get_node_data('node1') == {'a': 1}
+
+
+def test_multiprocess_refresh_keeps_the_node_references(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub1 = FileCacheHub(path, 0, multiprocess = True)
+    hub1.save_node_data('node1', {'a': 1})
+    hub2 = FileCacheHub(path, 0, multiprocess = True)
+    node1 = hub2.get_node_data('node1')
+
+    hub1.save_node_data('node1.a', 2)
+    hub2.refresh()
+
+    assert node1 == {'a': 2}
+
+
+def test_multiprocess_refresh_keeps_the_pending_changes(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub1 = FileCacheHub(path, 0, multiprocess = True)
+    hub2 = FileCacheHub(path, 60, multiprocess = True)
+
+    hub2.save_node_data('node2', [2])
+    hub1.save_node_data('node1', [1])
+    hub2.refresh()
+
+    assert hub2.get_node_data() == {'node1': [1], 'node2': [2]}
+    hub2._delayed_writer.cancel()
+
+
+def test_multiprocess_refresh_without_change(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub = FileCacheHub(path, 0, multiprocess = True)
+    hub.save_node_data('node1', [1])
+    tmpdir.join('cache.json').write('{}')
+
+    hub.refresh()
+
+    assert hub.get_node_data('node1') == [1]
+
+
+def test_multiprocess_default_node_keeps_the_keys_of_other_writers(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    node1 = DictCacheNode('shared', FileCacheHub(path, 0, multiprocess = True))
+    node2 = DictCacheNode('shared', FileCacheHub(path, 0, multiprocess = True))
+
+    node1['a'] = 1
+    node2['b'] = 2
+    node1['c'] = 3
+
+    with open(path) as f:
+        assert json.load(f) == {'shared': {'a': 1, 'b': 2, 'c': 3}}
+
+
+def test_multiprocess_merge_creates_the_default_list(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    hub1 = FileCacheHub(path, 0, multiprocess = True)
+    hub2 = FileCacheHub(path, 0, multiprocess = True)
+    items = ListCacheNode('items', hub1, [1, 2])
+
+    hub2.save_node_data('other', 1)
+    items.append(3)
+
+    with open(path) as f:
+        assert json.load(f) == {'items': [1, 2, 3], 'other': 1}
@@ -0,0 +1,102 @@
+import json
+import pytest
+from datetime import datetime
+
+from voidpp_tools.cache import FileCacheHub, LRUCacheNode
+from voidpp_tools.cache_serializers import (CompressedSerializer, ForbiddenSerializerException, JSONSerializer,
+                                            MarshalSerializer, PickleSerializer, UnknownSerializerException, dumps,
+                                            loads)
+
+@pytest.mark.parametrize('serializer', [
+    JSONSerializer(),
+    PickleSerializer(),
+    MarshalSerializer(),
+    CompressedSerializer(JSONSerializer()),
+    CompressedSerializer(PickleSerializer(), 'lzma'),
+])
+def test_dumps_loads(serializer):
+    data = {'node1': [1, 2.5, 'teve'], 'node2': {'a': None}}
+
+    assert loads(dumps(serializer, data)) == data
+
+
+def test_json_has_no_header():
+    assert dumps(JSONSerializer(), {'a': 1}) == '{"a": 1}'
+
+
+def test_unknown_serializer():
+    with pytest.raises(UnknownSerializerException):
+        loads(b'VPTCyaml\nteve')
+
+
+def test_hub_loads_legacy_json_with_other_serializer(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write('{"node1": [1, 2]}')
+
+    hub = FileCacheHub(path, 0, serializer = PickleSerializer())
+    hub.save_node_data('node2', {1, 2})
+
+    assert FileCacheHub(path, 0, allowed_formats = ['pickle']).get_node_data() == {'node1': [1, 2], 'node2': {1, 2}}
+
+
+def test_hub_journal_with_binary_serializer(tmpdir):
+    path = str(tmpdir.join('cache.bin'))
+    hub = FileCacheHub(path, 0, journal = True, compact_ratio = 100, serializer = MarshalSerializer())
+    hub.save_node_data('node1', [1])
+    hub.save_node_data('node2', (1, 2))
+
+    hub = FileCacheHub(path, 0, journal = True, allowed_formats = ['marshal'])
+
+    assert hub.get_node_data() == {'node1': [1], 'node2': (1, 2)}
+
+
+def test_hub_sharded_with_binary_serializer(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 0, sharded = True)
+    hub.save_node_data('node1', [1])
+    hub = FileCacheHub(path, 0, sharded = True, serializer = PickleSerializer())
+    hub.save_node_data('node1', [2])
+
+    assert tmpdir.join('cache').listdir() == [tmpdir.join('cache', 'node1.cache')]
+    hub = FileCacheHub(path, 0, sharded = True, lazy = True, serializer = PickleSerializer())
+
+    assert hub.get_node_data('node1') == [2]
+
+
+class DateEncoder(json.JSONEncoder):
+    def default(self, o):
+        return o.isoformat() if isinstance(o, datetime) else super(DateEncoder, self).default(o)
+
+
+@pytest.mark.parametrize('mode', [dict(journal = True), dict(lazy = True)])
+def test_hub_uses_the_json_encoder(tmpdir, mode):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write('{}')
+    hub = FileCacheHub(path, 0, serializer = JSONSerializer(DateEncoder), **mode)
+
+    hub.save_node_data('node1', {'at': datetime(2017, 1, 1)})
+
+    assert FileCacheHub(path, 0, **mode).get_node_data('node1') == {'at': '2017-01-01T00:00:00'}
+
+
+def test_lru_node_with_marshal(tmpdir):
+    path = str(tmpdir.join('cache.bin'))
+    node = LRUCacheNode('lru', FileCacheHub(path, 0, serializer = MarshalSerializer()), max_entries = 2)
+    node.set('a', (1, 2))
+    node.set('b', 2)
+
+    node = LRUCacheNode('lru', FileCacheHub(path, 0, serializer = MarshalSerializer()), max_entries = 2)
+
+    assert node.get('a') == (1, 2)
+    assert node.get('b') == 2
+
+
+def test_hub_refuses_the_not_allowed_formats(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    tmpdir.join('cache.json').write_binary(dumps(PickleSerializer(), {'node1': 1}))
+
+    with pytest.raises(ForbiddenSerializerException):
+        FileCacheHub(path, 0)
+
+    assert FileCacheHub(path, 0, serializer = PickleSerializer()).get_node_data('node1') == 1
+    assert FileCacheHub(path, 0, allowed_formats = ['pickle']).get_node_data('node1') == 1
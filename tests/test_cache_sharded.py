@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+import pytest
+
+from voidpp_tools.cache import FileCacheHub
+
+def test_sharded_writes_only_the_dirty_nodes(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 0, sharded = True)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node2.sub', [1])
+    os.remove(os.path.join(path, 'node1.json'))
+
+    hub.save_node_data('node2.sub', [2])
+
+    assert sorted(os.listdir(path)) == ['node2.json']
+    with open(os.path.join(path, 'node2.json')) as f:
+        assert json.load(f) == {'sub': [2]}
+
+
+def test_sharded_load(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 0, sharded = True)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node/2', [42])
+
+    hub = FileCacheHub(path, 0, sharded = True)
+
+    assert hub.get_node_data('node1') == {'a': 1}
+    assert hub.get_node_data('node/2') == [42]
+
+
+def test_sharded_root_save_removes_the_missing_nodes(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 0, sharded = True)
+    hub.save_node_data('', {'node1': 1, 'node2': 2})
+
+    hub.save_node_data('', {'node2': 3})
+
+    assert os.listdir(path) == ['node2.json']
+
+
+def test_sharded_root_must_be_dict(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache')), 0, sharded = True)
+
+    with pytest.raises(TypeError):
+        hub.save_node_data('', [1, 2])
+
+
+def test_failed_write_keeps_the_changes(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 10, sharded = True)
+    hub.save_node_data('a', {'x': 1})
+    write = hub._storage.write
+
+    def broken_write(data, changes):
+        raise IOError("No space left on device")
+
+    hub._storage.write = broken_write
+    with pytest.raises(IOError):
+        hub.flush()
+
+    hub._storage.write = write
+    hub.save_node_data('b', [2])
+    hub.flush()
+
+    with open(os.path.join(path, 'a.json')) as f:
+        assert json.load(f) == {'x': 1}
+    with open(os.path.join(path, 'b.json')) as f:
+        assert json.load(f) == [2]
+
+
+def test_failed_write_is_retried_with_backoff(tmpdir):
+    path = str(tmpdir.join('cache'))
+    hub = FileCacheHub(path, 0.01, sharded = True)
+    hub.flush_retry_limit = 2
+    hub.flush_retry_backoff = 0.02
+    write = hub._storage.write
+    attempts = []
+
+    def broken_write(data, changes):
+        attempts.append(time.monotonic())
+        raise IOError("No space left on device")
+
+    hub._storage.write = broken_write
+    hub.save_node_data('a', 1)
+    deadline = time.monotonic() + 5
+    while len(attempts) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.2)
+
+    assert len(attempts) == 3
+    assert attempts[2] - attempts[1] >= 0.035
+    assert hub.stats()['flush_error_count'] == 3
+    assert isinstance(hub.stats()['last_flush_error'], IOError)
+
+    hub._storage.write = write
+    hub.save_node_data('b', 2)
+    hub.flush()
+
+    assert sorted(os.listdir(path)) == ['a.json', 'b.json']
+    assert hub.stats()['last_flush_error'] is None
@@ -0,0 +1,42 @@
+from voidpp_tools.cache import FileCacheHub, LRUCacheNode
+
+def test_stats_counters(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0)
+    hub.get_node_data('node1', {})
+    hub.save_node_data('node1.a', 1)
+    hub.save_node_data('node2', [1])
+
+    stats = hub.stats()
+
+    assert stats['flush_count'] == 2
+    assert stats['flush_time']['count'] == 2
+    assert stats['save_count'] == 2
+    assert stats['saves_per_flush'] == 1
+    assert stats['bytes_written'] == len('{"node1": {"a": 1}}') + len('{"node1": {"a": 1}, "node2": [1]}')
+    assert stats['nodes'] == {'node1': dict(reads = 1, writes = 1, hits = 0, misses = 0),
+                              'node2': dict(reads = 0, writes = 1, hits = 0, misses = 0)}
+
+
+def test_stats_callback(tmpdir):
+    pushed = []
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0, stats_callback = pushed.append)
+
+    hub.save_node_data('node1', 1)
+
+    assert len(pushed) == 1
+    assert pushed[0]['flush_count'] == 1
+
+
+def test_stats_lru_hits_and_misses(tmpdir):
+    hub = FileCacheHub(str(tmpdir.join('cache.json')), 0)
+    node = LRUCacheNode('lru', hub)
+    node.set('a', 1)
+
+    node.get('a')
+    node.get('a')
+    node.get('b')
+
+    stats = hub.stats()
+
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['nodes']['lru'] == dict(reads = 1, writes = 1, hits = 2, misses = 1)
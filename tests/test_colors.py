@@ -0,0 +1,52 @@
+import logging
+from datetime import datetime
+
+from voidpp_tools.colors import Colors, ColoredLoggerFormatter, setup_queue_logging
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def test_formatter_uses_the_time_of_the_record():
+    record = logging.LogRecord('app', logging.ERROR, __file__, 42, 'answer: %s', (42, ), None)
+    record.created = 0
+
+    assert ColoredLoggerFormatter().format(record) == Colors.red + 'answer: 42' + Colors.default
+    assert str(datetime.fromtimestamp(0)) in ColoredLoggerFormatter(debug = True).format(record)
+
+
+def test_queue_logging():
+    handler = ListHandler()
+    handler.setFormatter(ColoredLoggerFormatter())
+    logger = logging.getLogger('test_queue_logging')
+    logger.propagate = False
+
+    listener = setup_queue_logging([handler], logger)
+    logger.info('message %s', 1)
+    logger.debug('filtered')
+    listener.stop()
+
+    assert handler.messages == [Colors.default + 'message 1' + Colors.default]
+    assert isinstance(logger.handlers[0], logging.handlers.QueueHandler)
+
+
+def test_queue_logging_respects_the_handler_levels():
+    handler = ListHandler()
+    errors = ListHandler()
+    errors.setLevel(logging.ERROR)
+    logger = logging.getLogger('test_queue_logging_levels')
+    logger.propagate = False
+
+    listener = setup_queue_logging([handler, errors], logger)
+    logger.info('info')
+    logger.error('error')
+    listener.stop()
+
+    assert handler.messages == ['info', 'error']
+    assert errors.messages == ['error']
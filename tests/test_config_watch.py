@@ -0,0 +1,83 @@
+import os
+import json
+import time
+
+from voidpp_tools.json_config import JSONConfigLoader
+
+def write_config(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def create_loader(tmpdir, **kwargs):
+    loader = JSONConfigLoader(str(tmpdir.join('app.py')), **kwargs)
+    loader.sources = [str(tmpdir)]
+    return loader
+
+
+def test_load_is_cached_until_the_file_changes(tmpdir):
+    path = str(tmpdir.join('app.json'))
+    write_config(path, {'the_answer': 42})
+    loader = create_loader(tmpdir)
+    reads = []
+    read = loader._ConfigLoader__read_config_file
+    loader._ConfigLoader__read_config_file = lambda filename: reads.append(filename) or read(filename)
+
+    data = loader.load('app.json')
+    data['the_answer'] = 24
+
+    assert loader.load('app.json') == {'the_answer': 42}
+    assert reads == [path]
+
+    write_config(path, {'the_answer': 43, 'size': 'changed'})
+
+    assert loader.load('app.json') == {'the_answer': 43, 'size': 'changed'}
+
+
+def test_load_without_cache(tmpdir):
+    write_config(str(tmpdir.join('app.json')), {'the_answer': 42})
+    loader = create_loader(tmpdir, cache = False)
+
+    assert loader.load('app.json') is not loader.load('app.json')
+
+
+def test_save_invalidates_the_cache(tmpdir):
+    write_config(str(tmpdir.join('app.json')), {'the_answer': 42})
+    loader = create_loader(tmpdir)
+    loader.load('app.json')
+
+    loader.save({'the_answer': 24})
+
+    assert loader.load('app.json') == {'the_answer': 24}
+
+
+def test_watcher_calls_the_subscribers(tmpdir):
+    path = str(tmpdir.join('app.json'))
+    write_config(path, {'the_answer': 42})
+    loader = create_loader(tmpdir)
+    configs = []
+
+    watcher = loader.watch('app.json', configs.append, interval = 0.01)
+    time.sleep(0.03)
+    assert configs == []
+
+    write_config(path, {'the_answer': 43, 'size': 'changed'})
+    time.sleep(0.05)
+    watcher.stop()
+
+    assert configs == [{'the_answer': 43, 'size': 'changed'}]
+
+
+def test_watcher_survives_the_removed_file(tmpdir):
+    path = str(tmpdir.join('app.json'))
+    write_config(path, {'the_answer': 42})
+    loader = create_loader(tmpdir)
+    configs = []
+    watcher = loader.watch('app.json', configs.append, interval = 10)
+    watcher.stop()
+
+    os.remove(path)
+    assert not watcher.check()
+
+    write_config(path, {'the_answer': 1})
+    assert watcher.check()
+    assert configs == [{'the_answer': 1}]
@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import logging
+import threading
+import socket
+import subprocess
+from signal import SIGTERM, SIGHUP
+
+from voidpp_tools.job_delayer import JobDelayer
+from voidpp_tools.daemon import Daemon, get_rss, get_process_stats, wait_for_pid
+
+logger = logging.getLogger(__name__)
+
+class RecordingDaemon(Daemon):
+
+    def __init__(self, log_dir, fail = False, **kwargs):
+        super(RecordingDaemon, self).__init__(os.path.join(log_dir, 'daemon.pid'), logger, **kwargs)
+        self.log_dir = log_dir
+        self.fail = fail
+
+    def worker_run(self):
+        with open(os.path.join(self.log_dir, 'worker-%s' % self.worker_id), 'a') as f:
+            f.write('%s\n' % os.getpid())
+        if self.fail:
+            raise Exception("crash")
+        while not self.should_exit():
+            time.sleep(0.01)
+            self.job_done()
+
+    def started_pids(self, worker_id):
+        path = os.path.join(self.log_dir, 'worker-%s' % worker_id)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return f.read().split()
+
+
+class ReloadingDaemon(RecordingDaemon):
+
+    def reload(self):
+        name = 'master' if self.worker_id is None else self.worker_id
+        with open(os.path.join(self.log_dir, 'reload-%s' % name), 'w') as f:
+            f.write('%s\n' % os.getpid())
+
+
+class ShortLivedDaemon(RecordingDaemon):
+
+    def worker_run(self):
+        with open(os.path.join(self.log_dir, 'worker-%s' % self.worker_id), 'a') as f:
+            f.write('%s\n' % os.getpid())
+        delayed_file = os.path.join(self.log_dir, 'delayed-%s' % os.getpid())
+        JobDelayer(lambda: open(delayed_file, 'w').close(), 60).start()
+
+
+class StuckDaemon(RecordingDaemon):
+
+    def shutdown(self):
+        pass
+
+    def worker_run(self):
+        while True:
+            time.sleep(0.01)
+
+
+def signal_later(delay, signum = SIGTERM):
+    timer = threading.Timer(delay, os.kill, (os.getpid(), signum))
+    timer.start()
+    return timer
+
+def stop_later(delay):
+    return signal_later(delay)
+
+
+def test_workers_are_recycled_after_max_jobs(tmpdir):
+    daemon = RecordingDaemon(str(tmpdir), workers = 2, max_jobs = 5)
+    daemon.min_worker_lifetime = 0
+
+    stop_later(0.4)
+    daemon.run_workers()
+
+    for worker_id in range(2):
+        pids = daemon.started_pids(worker_id)
+        # ~50ms per worker life
+        assert len(pids) >= 3
+        assert len(set(pids)) == len(pids)
+
+
+def test_workers_stop_at_sigterm(tmpdir):
+    daemon = RecordingDaemon(str(tmpdir), workers = 3)
+
+    stop_later(0.2)
+    started = time.monotonic()
+    daemon.run_workers()
+
+    assert time.monotonic() - started < 1
+    assert [len(daemon.started_pids(worker_id)) for worker_id in range(3)] == [1, 1, 1]
+
+
+def test_crashed_workers_respawn_with_backoff(tmpdir):
+    daemon = RecordingDaemon(str(tmpdir), fail = True, workers = 1, respawn_backoff = 0.05)
+
+    stop_later(0.5)
+    daemon.run_workers()
+
+    # respawns after 0.05, 0.1, 0.2 sec
+    assert 3 <= len(daemon.started_pids(0)) <= 4
+
+
+def test_get_rss():
+    assert get_rss() > 0
+
+
+def test_get_process_stats():
+    stats = get_process_stats()
+
+    assert stats['rss'] > 0
+    assert stats['cpu_time'] > 0
+    assert stats['threads'] >= 1
+    assert stats['fds'] >= 3
+
+
+def test_control_socket_stats(tmpdir):
+    daemon = Daemon(str(tmpdir.join('daemon.pid')), logger, control_socket = str(tmpdir.join('control.sock')))
+    daemon.write_pid()
+    daemon.start_control_server()
+    daemon.incr('requests')
+    daemon.incr('requests', 2)
+    daemon.heartbeat()
+
+    stats = daemon.query_control('stats')
+
+    assert stats['pid'] == os.getpid()
+    assert stats['counters'] == {'requests': 3}
+    assert 0 <= stats['heartbeat_age'] < 1
+    assert stats['uptime'] >= 0
+    assert stats['threads'] >= 2
+    assert 'error' in daemon.query_control('foo')
+
+    status = daemon.status(verbose = True).split('\n')
+    assert status[0] == 'Daemon is running'
+    assert 'counters.requests: 3' in status
+    assert daemon.status() == 'Daemon is running'
+
+
+def test_control_socket_is_private_and_not_blocked_by_idle_clients(tmpdir):
+    path = str(tmpdir.join('control.sock'))
+    daemon = Daemon(str(tmpdir.join('daemon.pid')), logger, control_socket = path)
+    daemon.control_timeout = 0.1
+    old_umask = os.umask(0)
+    try:
+        daemon.start_control_server()
+    finally:
+        os.umask(old_umask)
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    idle.connect(path)
+    try:
+        assert daemon.query_control('stats', timeout = 1)['pid'] == os.getpid()
+    finally:
+        idle.close()
+
+
+def test_wait_for_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(0.1)'])
+    assert wait_for_pid(process.pid, 5)
+    process.wait()
+
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(5)'])
+    assert not wait_for_pid(process.pid, 0.05)
+    process.kill()
+    process.wait()
+
+
+def test_stop_kills_after_the_timeout(tmpdir):
+    code = 'import signal, time, sys; signal.signal(signal.SIGTERM, signal.SIG_IGN); print(1); sys.stdout.flush(); ' \
+           'time.sleep(5)'
+    process = subprocess.Popen([sys.executable, '-c', code], stdout = subprocess.PIPE)
+    process.stdout.readline()
+    daemon = RecordingDaemon(str(tmpdir), stop_timeout = 0.1)
+    with open(daemon.pidfile, 'w') as f:
+        f.write('%s\n' % process.pid)
+
+    started = time.monotonic()
+    assert daemon.stop() == 'Daemon is stopped'
+
+    assert time.monotonic() - started < 2
+    assert process.wait() == -9
+    assert not os.path.exists(daemon.pidfile)
+
+
+def test_master_kills_the_stuck_workers(tmpdir):
+    daemon = StuckDaemon(str(tmpdir), workers = 2, stop_timeout = 0.2)
+
+    stop_later(0.2)
+    started = time.monotonic()
+    daemon.run_workers()
+
+    assert time.monotonic() - started < 1
+
+
+def test_reload_in_master_and_workers(tmpdir):
+    daemon = ReloadingDaemon(str(tmpdir), workers = 2)
+
+    signal_later(0.2, SIGHUP)
+    stop_later(0.4)
+    daemon.run_workers()
+
+    for name in ['master', 0, 1]:
+        assert tmpdir.join('reload-%s' % name).check()
+    # reloaded without respawn
+    assert [len(daemon.started_pids(worker_id)) for worker_id in range(2)] == [1, 1]
+
+
+DAEMON_SCRIPT = """
+import os, sys, logging
+sys.path.insert(0, {repo!r})
+from voidpp_tools.job_delayer import JobDelayer
+from voidpp_tools.daemon import Daemon
+
+class PidServer(Daemon):
+    def init(self):
+        self.server = self.listen(('127.0.0.1', 0), name = 'main')
+        with open({port_file!r}, 'w') as f:
+            f.write(str(self.server.getsockname()[1]))
+        return True, 'Ok'
+
+    def run(self):
+        while True:
+            connection = self.server.accept()[0]
+            connection.sendall(str(os.getpid()).encode())
+            connection.close()
+
+logger = logging.getLogger('daemon')
+logger.addHandler(logging.FileHandler({log_file!r}))
+PidServer({pidfile!r}, logger, stop_timeout = 2).start()
+"""
+
+def ask_pid(port):
+    connection = socket.create_connection(('127.0.0.1', port), timeout = 2)
+    try:
+        return int(connection.recv(100))
+    finally:
+        connection.close()
+
+def test_graceful_restart_hands_over_the_listening_socket(tmpdir):
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pidfile = str(tmpdir.join('daemon.pid'))
+    port_file = str(tmpdir.join('port'))
+    script = tmpdir.join('pid_server.py')
+    script.write(DAEMON_SCRIPT.format(repo = repo, port_file = port_file, log_file = str(tmpdir.join('log')),
+                                      pidfile = pidfile))
+    subprocess.check_call([sys.executable, str(script)], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+    client = Daemon(pidfile, logger, stop_timeout = 2)
+    deadline = time.monotonic() + 5
+    while not client.is_running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    old_pid = client.get_pid()
+
+    try:
+        port = int(tmpdir.join('port').read())
+        assert ask_pid(port) == old_pid
+
+        assert client.restart(graceful = True) == 'Daemon is restarted'
+
+        new_pid = client.get_pid()
+        assert new_pid != old_pid
+        assert ask_pid(port) == new_pid
+        # the port file is rewritten by the init of the replacement
+        assert int(tmpdir.join('port').read()) == port
+    finally:
+        client.stop()
+
+
+def test_short_lived_clean_workers_respawn_with_backoff(tmpdir):
+    daemon = ShortLivedDaemon(str(tmpdir), workers = 1, respawn_backoff = 0.1)
+
+    stop_later(0.5)
+    daemon.run_workers()
+
+    pids = daemon.started_pids(0)
+    # respawns after 0.1, 0.2 sec
+    assert 2 <= len(pids) <= 4
+    # the pending delayed jobs run before the worker exits
+    for pid in pids:
+        assert tmpdir.join('delayed-%s' % pid).check()
@@ -0,0 +1,252 @@
+import os
+import time
+import threading
+
+import pytest
+
+from voidpp_tools.timer import DeadlineScheduler
+from voidpp_tools.job_delayer import (JobDelayer, BatchJobDelayer, BatchQueueFullException, Throttle,
+                                      _drain_pending_delayers)
+
+def test_job_runs_after_the_last_start():
+    calls = []
+    delayer = JobDelayer(lambda: calls.append(time.monotonic()), 0.05)
+
+    start = time.monotonic()
+    for _ in range(3):
+        delayer.start()
+        time.sleep(0.02)
+    time.sleep(0.1)
+
+    assert len(calls) == 1
+    assert calls[0] - start >= 0.09
+
+
+def test_max_delay_bounds_the_restarts():
+    calls = []
+    delayer = JobDelayer(lambda: calls.append(1), 0.05, max_delay = 0.1)
+
+    for _ in range(10):
+        delayer.start()
+        time.sleep(0.02)
+
+    assert calls
+    delayer.cancel()
+
+
+def test_cancel():
+    calls = []
+    delayer = JobDelayer(lambda: calls.append(1), 0.02)
+    delayer.start()
+
+    assert delayer.cancel()
+    time.sleep(0.05)
+
+    assert calls == []
+    assert not delayer.cancel()
+
+
+def test_flush_now():
+    calls = []
+    delayer = JobDelayer(lambda: calls.append(1), 10)
+    delayer.start()
+
+    assert delayer.flush_now()
+    assert calls == [1]
+    assert not delayer.pending
+    assert not delayer.flush_now()
+
+
+def test_exit_drain():
+    calls = []
+    delayer = JobDelayer(lambda: calls.append(1), 10)
+    delayer.start()
+
+    _drain_pending_delayers()
+
+    assert calls == [1]
+
+
+def test_delayers_do_not_create_threads():
+    calls = []
+    delayers = [JobDelayer(lambda: calls.append(1), 0.01) for _ in range(50)]
+    threads = threading.active_count()
+
+    for _ in range(5):
+        for delayer in delayers:
+            delayer.start()
+
+    assert threading.active_count() <= threads + 1
+    time.sleep(0.1)
+    assert len(calls) == 50
+
+
+def test_batch_by_size_and_delay():
+    batches = []
+    delayer = BatchJobDelayer(batches.append, max_size = 3, max_delay = 0.05)
+
+    for item in range(4):
+        delayer.submit(item)
+    time.sleep(0.02)
+
+    assert batches == [[0, 1, 2]]
+    assert delayer.pending == 1
+
+    time.sleep(0.06)
+
+    assert batches == [[0, 1, 2], [3]]
+    assert delayer.pending == 0
+
+
+def test_batch_backpressure():
+    release = threading.Event()
+    batches = []
+
+    def job(batch):
+        release.wait()
+        batches.append(batch)
+
+    delayer = BatchJobDelayer(job, max_size = 2, max_delay = 10, max_pending = 2)
+    delayer.submit(1)
+    delayer.submit(2)
+
+    with pytest.raises(BatchQueueFullException):
+        delayer.submit(3, block = False)
+    with pytest.raises(BatchQueueFullException):
+        delayer.submit(3, timeout = 0.01)
+
+    release.set()
+    delayer.submit(3, timeout = 1)
+    assert delayer.flush_now()
+
+    assert batches == [[1, 2], [3]]
+
+
+def test_batch_delayer_after_pool_shutdown():
+    scheduler = DeadlineScheduler(1)
+    scheduler.executor.shutdown()
+    batches = []
+    delayer = BatchJobDelayer(batches.append, max_size = 2, scheduler = scheduler)
+
+    thread = threading.Thread(target = lambda: [delayer.submit(item) for item in range(2)])
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert batches == [[0, 1]]
+
+
+def test_throttle_leading_and_trailing():
+    calls = []
+    throttle = Throttle(lambda: calls.append(time.monotonic()), 0.05)
+
+    start = time.monotonic()
+    for _ in range(12):
+        throttle()
+        time.sleep(0.01)
+    time.sleep(0.15)
+
+    # leading at 0, then trailing runs at the ends of the intervals of the burst (0.05, 0.1, 0.15, maybe 0.2)
+    assert 3 <= len(calls) <= 5
+    assert calls[0] - start < 0.03
+    assert all(b - a >= 0.04 for a, b in zip(calls, calls[1:]))
+
+
+def test_throttle_interval_starts_with_the_run():
+    scheduler = DeadlineScheduler(1)
+    calls = []
+    throttle = Throttle(lambda: calls.append(time.monotonic()), 0.05, scheduler = scheduler)
+
+    # the only worker is busy, so the leading run starts late
+    scheduler.submit(lambda: time.sleep(0.05))
+    throttle()
+    time.sleep(0.07)
+    throttle()
+    time.sleep(0.1)
+
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.04
+
+
+def test_throttle_logs_the_exceptions(caplog):
+    def job():
+        raise ValueError('no')
+    throttle = Throttle(job, 0.02)
+
+    throttle()
+    throttle()
+    errors = lambda: [record.exc_info[0] for record in caplog.records if record.exc_info]
+    deadline = time.monotonic() + 5
+    while len(errors()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert errors() == [ValueError, ValueError]
+
+
+def test_throttle_only_leading():
+    calls = []
+    throttle = Throttle(lambda: calls.append(1), 0.05, trailing = False)
+
+    for _ in range(3):
+        throttle()
+    time.sleep(0.08)
+    throttle()
+    time.sleep(0.02)
+
+    assert calls == [1, 1]
+
+
+def test_throttle_many_threads():
+    calls = []
+    throttle = Throttle(lambda: calls.append(1), 0.05, leading = False)
+
+    threads = [threading.Thread(target = lambda: [throttle() for _ in range(100)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    time.sleep(0.12)
+
+    assert 1 <= len(calls) <= 2
+
+
+def test_delayer_created_before_fork():
+    calls = []
+    delayer = JobDelayer(lambda: calls.append(1), 0.01)
+    delayer.start()
+    time.sleep(0.05)
+
+    pid = os.fork()
+    if pid == 0:
+        delayer.start()
+        time.sleep(0.1)
+        os._exit(0 if calls == [1, 1] and not delayer.pending else 1)
+
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_pending_job_is_not_run_in_the_forked_child():
+    calls = []
+    parent_delayer = JobDelayer(lambda: calls.append('parent'), 0.05)
+    parent_delayer.start()
+
+    pid = os.fork()
+    if pid == 0:
+        JobDelayer(lambda: calls.append('child'), 0.01).start()
+        time.sleep(0.15)
+        _drain_pending_delayers()
+        os._exit(0 if calls == ['child'] and not parent_delayer.pending else 1)
+
+    assert os.waitpid(pid, 0)[1] == 0
+    time.sleep(0.1)
+    assert calls == ['parent']
+
+
+def test_delayer_uses_the_given_scheduler():
+    scheduler = DeadlineScheduler(1)
+    delayer = JobDelayer(lambda: None, 10, scheduler = scheduler)
+    delayer.start()
+
+    assert scheduler.scheduled_count == 1
+    delayer.cancel()
@@ -0,0 +1,59 @@
+import time
+import pytest
+
+from voidpp_tools.compat import UnsupportedOperation
+from voidpp_tools.logger_proxy import LoggerProxy
+
+def test_assembles_the_lines():
+    records = []
+    proxy = LoggerProxy(records.append)
+
+    print('a', 'b', file = proxy)
+    proxy.write('c')
+    proxy.writelines(['d\ne', 'f\n\n'])
+    proxy.write('partial')
+
+    assert records == ['a b', 'cd', 'ef']
+
+    proxy.flush()
+
+    assert records == ['a b', 'cd', 'ef', 'partial']
+
+
+def test_size_and_time_bounds():
+    records = []
+    proxy = LoggerProxy(records.append, max_buffer = 5, flush_interval = 0.02)
+
+    proxy.write('abc')
+    proxy.write('def')
+    assert records == ['abcdef']
+
+    proxy.write('x')
+    time.sleep(0.03)
+    proxy.write('y')
+    assert records == ['abcdef', 'xy']
+
+
+def test_background_thread():
+    records = []
+    proxy = LoggerProxy(records.append, flush_interval = 0.02, background = True)
+
+    proxy.write('line\npartial')
+    time.sleep(0.1)
+
+    assert records == ['line', 'partial']
+
+    proxy.write('last')
+    proxy.close()
+
+    assert records == ['line', 'partial', 'last']
+
+
+def test_stream_interface():
+    proxy = LoggerProxy(lambda msg: None)
+
+    assert not proxy.isatty()
+    assert proxy.writable()
+    with pytest.raises(UnsupportedOperation):
+        proxy.fileno()
+    assert LoggerProxy(lambda msg: None, fd = 2).fileno() == 2
@@ -0,0 +1,141 @@
+import sqlite3
+from collections import OrderedDict
+
+from voidpp_tools.cache import DictCacheNode
+from voidpp_tools.cache_serializers import JSONSerializer, PickleSerializer, dumps
+from voidpp_tools.sqlite_cache import SQLiteCacheHub
+
+def select_rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute('SELECT node, key FROM cache_nodes ORDER BY node, key').fetchall()
+    finally:
+        connection.close()
+
+
+def test_sqlite_node_per_row(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0)
+    hub.save_node_data('node1', {'a': 1})
+    hub.save_node_data('node2.sub', [1, 2])
+
+    assert select_rows(path) == [('node1', ''), ('node2', '')]
+
+    hub = SQLiteCacheHub(path, 0)
+
+    assert hub.get_node_data('node2') == {'sub': [1, 2]}
+    assert list(hub._data) == ['node2']
+
+
+def test_sqlite_split_mappings(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, split_mappings = True)
+    node = DictCacheNode('node', hub)
+    node['a'] = 1
+    node['b'] = [2]
+    hub.save_node_data('other', 3)
+
+    assert select_rows(path) == [('node', '.a'), ('node', '.b'), ('other', '')]
+
+    del node['a']
+
+    assert SQLiteCacheHub(path, 0, lazy = False, split_mappings = True).get_node_data() == {'node': {'b': [2]},
+                                                                                           'other': 3}
+
+
+def test_sqlite_root_save(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, serializer = PickleSerializer())
+    hub.save_node_data('node1', 1)
+
+    hub.save_node_data('', {'node2': {1, 2}})
+
+    assert SQLiteCacheHub(path, 0, serializer = PickleSerializer()).get_node_data() == {'node2': {1, 2}}
+
+
+def test_sqlite_split_mapping_reads_the_used_keys(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, split_mappings = True)
+    hub.save_node_data('node', {str(idx): idx for idx in range(100)})
+
+    hub = SQLiteCacheHub(path, 0, split_mappings = True)
+    node = DictCacheNode('node', hub)
+    loaded = []
+    load_key = hub._storage.load_key
+    hub._storage.load_key = lambda name, key: loaded.append(key) or load_key(name, key)
+    hub._storage.load_keys = None
+
+    assert node['42'] == 42
+    assert 'x' not in node._data
+    node['x'] = 1
+    del node['1']
+
+    assert loaded == ['42', 'x', '1']
+    assert select_rows(path)[-1] == ('node', '.x')
+    assert ('node', '.1') not in select_rows(path)
+
+
+def test_sqlite_split_mapping_emptied(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, split_mappings = True)
+    node = DictCacheNode('node', hub)
+    node['a'] = 1
+    del node['a']
+
+    assert select_rows(path) == [('node', '')]
+    assert SQLiteCacheHub(path, 0, split_mappings = True).get_node_data('node') == {}
+
+    node['b'] = 2
+
+    assert select_rows(path) == [('node', '.b')]
+    assert SQLiteCacheHub(path, 0, lazy = False, split_mappings = True).get_node_data('node') == {'b': 2}
+
+
+def test_sqlite_split_mapping_keeps_the_order(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, split_mappings = True)
+    hub.save_node_data('node', OrderedDict([('b', 1), ('a', 2), ('c', 3)]))
+
+    assert list(SQLiteCacheHub(path, 0, split_mappings = True).get_node_data('node')) == ['b', 'a', 'c']
+    assert list(SQLiteCacheHub(path, 0, lazy = False, split_mappings = True).get_node_data('node')) == ['b', 'a', 'c']
+
+
+def test_sqlite_bytes_written(tmpdir):
+    hub = SQLiteCacheHub(str(tmpdir.join('cache.db')), 0, split_mappings = True)
+    hub.save_node_data('node', {'a': 'árvíz'})
+
+    content = dumps(JSONSerializer(), 'árvíz')
+    content = content if isinstance(content, bytes) else content.encode('utf-8')
+
+    assert hub._storage.bytes_written == len(content)
+
+
+def test_sqlite_split_mapping_update_keeps_the_order(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, split_mappings = True)
+    node = DictCacheNode('node', hub)
+    node['a'] = {'x': 1}
+    node['b'] = 2
+
+    hub.save_node_data('node.a.x', 3)
+
+    assert list(SQLiteCacheHub(path, 0, split_mappings = True).get_node_data('node')) == ['a', 'b']
+    assert SQLiteCacheHub(path, 0, lazy = False, split_mappings = True).get_node_data('node') == {'a': {'x': 3},
+                                                                                                 'b': 2}
+
+
+def test_sqlite_split_mapping_with_not_str_keys(tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    hub = SQLiteCacheHub(path, 0, split_mappings = True, serializer = PickleSerializer())
+    node = DictCacheNode('node', hub)
+    node[1] = 'one'
+    node['a'] = 'x'
+
+    assert select_rows(path) == [('node', '')]
+
+    del node[1]
+    node['b'] = 'y'
+
+    assert select_rows(path) == [('node', '.a'), ('node', '.b')]
+    assert SQLiteCacheHub(path, 0, split_mappings = True, serializer = PickleSerializer()).get_node_data('node') == \
+        {'a': 'x', 'b': 'y'}
@@ -0,0 +1,16 @@
+from voidpp_tools.stats import Histogram
+
+def test_histogram_percentiles():
+    histogram = Histogram([1, 2, 4, 8])
+
+    for value in [0.5] * 50 + [3] * 40 + [100] * 10:
+        histogram.add(value)
+
+    assert histogram.percentile(50) == 1
+    assert histogram.percentile(90) == 4
+    assert histogram.percentile(99) == 100
+    assert histogram.as_dict()['max'] == 100
+
+
+def test_empty_histogram():
+    assert Histogram().as_dict()['p50'] is None
@@ -0,0 +1,222 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+from datetime import datetime
+from threading import Event
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from voidpp_tools.timer import CronExpression, DaemonThreadPool, DeadlineScheduler, Scheduler, Timer, \
+    default_pool_size, get_timer_executor
+
+def test_deadline_scheduler_order():
+    scheduler = DeadlineScheduler(1)
+    calls = []
+    done = Event()
+
+    scheduler.call_later(0.03, calls.append, 3)
+    scheduler.call_later(0.01, calls.append, 1)
+    scheduler.call_later(0.02, calls.append, 2)
+    scheduler.call_later(0.04, done.set)
+
+    assert done.wait(1)
+    assert calls == [1, 2, 3]
+
+
+def test_deadline_scheduler_reschedule_and_cancel():
+    scheduler = DeadlineScheduler(1)
+    calls = []
+    call = scheduler.call_later(0.05, calls.append, 1)
+    cancelled = scheduler.call_later(0.05, calls.append, 2)
+
+    call.schedule_later(0.3)
+    assert cancelled.cancel()
+    time.sleep(0.15)
+
+    assert calls == []
+    assert scheduler.scheduled_count == 1
+    time.sleep(0.4)
+    assert calls == [1]
+    assert scheduler.scheduled_count == 0
+
+
+def run_slow_timer(**kwargs):
+    calls = []
+
+    def callback():
+        calls.append(time.monotonic())
+        time.sleep(0.1)
+
+    timer = Timer(0.02, callback, executor = ThreadPoolExecutor(4), **kwargs)
+    timer.start()
+    time.sleep(0.15)
+    timer.stop()
+    time.sleep(0.15)
+    return timer, calls
+
+
+def test_timer_overrun_skip():
+    timer, calls = run_slow_timer()
+
+    assert len(calls) == 2
+    assert timer.overrun_count > 0
+
+
+def test_timer_overrun_queue():
+    timer, calls = run_slow_timer(overrun = Timer.QUEUE)
+
+    # the queued run starts right after the first one
+    assert 2 <= len(calls) <= 3
+    assert calls[1] - calls[0] < 0.12
+
+
+def test_timer_max_concurrent():
+    timer, calls = run_slow_timer(max_concurrent = 3)
+
+    assert len(calls) >= 3
+    assert calls[2] - calls[0] < 0.1
+
+
+def test_timer_does_not_drift():
+    calls = []
+    timer = Timer(0.02, lambda: calls.append(time.monotonic()), executor = ThreadPoolExecutor(1))
+    timer.start()
+    time.sleep(0.21)
+    timer.stop()
+
+    assert len(calls) == 10
+    assert timer.stats()['duration']['count'] == 10
+
+
+def test_timer_catch_up():
+    timer = Timer(1, lambda: None)
+
+    assert timer._next_deadline(10, 13.5) == 14
+    assert timer.missed_count == 3
+
+    timer.catch_up = Timer.CATCH_UP_ALL
+    assert timer._next_deadline(10, 13.5) == 11
+
+    timer.catch_up = Timer.CATCH_UP_RESET
+    assert timer._next_deadline(10, 13.5) == 14.5
+
+
+def test_timer_exception_count():
+    def callback():
+        raise Exception("teve")
+
+    timer = Timer(0.01, callback)
+    timer.start()
+    time.sleep(0.035)
+    timer.stop()
+    time.sleep(0.01)
+
+    assert timer.stats()['exception_count'] >= 2
+
+
+@pytest.mark.parametrize('expression, after, expected', [
+    ('*/15 * * * *', datetime(2017, 1, 1, 10, 7, 30), datetime(2017, 1, 1, 10, 15)),
+    ('0 3 * * *', datetime(2017, 1, 1, 10, 7), datetime(2017, 1, 2, 3, 0)),
+    ('30 12 1 * *', datetime(2017, 1, 31, 10, 7), datetime(2017, 2, 1, 12, 30)),
+    ('0 0 * * 1', datetime(2017, 1, 1, 10, 7), datetime(2017, 1, 2, 0, 0)), # 2017-01-02 is Monday
+    ('0 0 13 * 5', datetime(2017, 1, 1, 10, 7), datetime(2017, 1, 6, 0, 0)), # day or weekday
+    ('0 0 29 2 *', datetime(2017, 1, 1), datetime(2020, 2, 29)),
+])
+def test_cron_next_time(expression, after, expected):
+    assert CronExpression(expression).next_time(after) == expected
+
+
+def test_cron_invalid():
+    with pytest.raises(ValueError):
+        CronExpression('60 * * * *')
+
+
+def test_scheduler_runs_lots_of_jobs():
+    deadline_scheduler = DeadlineScheduler(4)
+    scheduler = Scheduler(deadline_scheduler)
+    calls = []
+    seen = set()
+    all_ran = Event()
+    threads = threading.active_count()
+
+    def job(index):
+        calls.append(index)
+        seen.add(index)
+        if len(seen) == 500:
+            all_ran.set()
+
+    jobs = [scheduler.every(0.02, lambda index = index: job(index)) for index in range(500)]
+
+    assert all_ran.wait(10)
+    assert threading.active_count() <= threads + 5
+
+    scheduler.stop()
+    # the runs picked up before the stop finish in the pool
+    deadline_scheduler.executor.shutdown()
+    count = len(calls)
+    time.sleep(0.1)
+
+    assert len(calls) == count
+    assert not any(job.is_running() for job in jobs)
+
+
+def test_scheduler_job_restart():
+    scheduler = Scheduler(DeadlineScheduler(1))
+    calls = []
+    job = scheduler.every(0.01, lambda: calls.append(1))
+    job.stop()
+    time.sleep(0.03)
+
+    assert calls == []
+
+    job.start(0.02)
+    time.sleep(0.05)
+
+    assert len(calls) == 2
+    scheduler.stop()
+
+
+def test_slow_timer_callback_does_not_block_the_exit():
+    code = 'import sys, time; sys.path.insert(0, {!r}); from voidpp_tools.timer import Timer; ' \
+           't = Timer(0.01, lambda: time.sleep(3)); t.start(); time.sleep(0.1)'.format(
+               os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    started = time.monotonic()
+    subprocess.check_call([sys.executable, '-c', code])
+
+    assert time.monotonic() - started < 2
+
+
+def test_daemon_thread_pool():
+    pool = DaemonThreadPool(2)
+    futures = [pool.submit(lambda value: value * 2, value) for value in range(10)]
+
+    assert [future.result(1) for future in futures] == list(range(0, 20, 2))
+    with pytest.raises(ZeroDivisionError):
+        pool.submit(lambda: 1 / 0).result(1)
+
+
+def test_daemon_thread_pool_shutdown():
+    pool = DaemonThreadPool(2)
+    future = pool.submit(time.sleep, 0.1)
+    pool.shutdown()
+
+    assert future.done()
+    with pytest.raises(RuntimeError):
+        pool.submit(time.sleep, 0)
+
+
+def test_timer_and_scheduler_pools_have_the_same_size():
+    assert get_timer_executor()._max_workers == DeadlineScheduler().executor._max_workers == default_pool_size()
+
+
+def test_running_scheduler_job_is_waited_at_exit(tmpdir):
+    path = str(tmpdir.join('done'))
+    code = 'import sys, time; sys.path.insert(0, {!r}); from voidpp_tools.timer import get_default_scheduler; ' \
+           'get_default_scheduler().submit(lambda: (time.sleep(0.3), open({!r}, "w").close())); time.sleep(0.1)'.format(
+               os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+    subprocess.check_call([sys.executable, '-c', code])
+
+    assert os.path.exists(path)
@@ -1,17 +1,537 @@
-
+import copy
 import json
 import os
+import hashlib
 import logging
-from voidpp_tools.job_delayer import JobDelayer
+import struct
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping, MutableSequence
+from functools import wraps
+from contextlib import contextmanager
+from threading import Event, Lock, RLock, Thread
+from urllib.parse import quote, unquote
+from voidpp_tools.job_delayer import JobDelayer, AsyncJobDelayer
+from voidpp_tools.cache_serializers import CacheSerializer, JSONSerializer, dumps, header, loads, readable_formats, \
+    split_header
+from voidpp_tools.timer import Timer, get_scheduler
+from voidpp_tools.stats import Histogram
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+def _set_path(root, path: str, value, force):
+    """Walk (and create) the dot separated path in the root data, the list items can be addressed by index
+
+    Returns:
+        tuple: the (maybe replaced) root and the data of the node
+    """
+    if not path:
+        if not root or force:
+            root = value
+        return root, root
+
+    data = root
+    parts = path.split('.')
+
+    for part in parts[:-1]:
+        if isinstance(data, list):
+            data = data[int(part)]
+            continue
+        if part not in data:
+            data[part] = {}
+        data = data[part]
+
+    last_part = parts[-1]
+
+    if isinstance(data, list):
+        # the list items are addressed by index, the index after the last item means append
+        index = int(last_part)
+        if index == len(data):
+            data.append(value)
+        elif force:
+            data[index] = value
+        return root, data[index]
+
+    if last_part not in data or force:
+        data[last_part] = value
+
+    return root, data[last_part]
+
+def _merge_path(target, source, path: str, value):
+    """Set the path in the target like _set_path, but a missing parent is copied from the source (the local data), so
+    the new nodes of the source keep their default data and type (eg a list node is not turned into a dict)
+
+    Returns:
+        the (maybe replaced) target
+    """
+    parts = path.split('.') if path else []
+    data = target
+    for depth, part in enumerate(parts[:-1]):
+        exists = part.isdigit() and int(part) < len(data) if isinstance(data, list) else part in data
+        if not exists:
+            parent = '.'.join(parts[:depth + 1])
+            target, _ = _set_path(target, parent, copy.deepcopy(_set_path(source, parent, None, False)[1]), True)
+            return target
+        data = data[int(part)] if isinstance(data, list) else data[part]
+    return _set_path(target, path, value, True)[0]
+
+def _update_in_place(target: dict, source: dict, skip = ()):
+    """Make the target equal to the source, but keep the identity of the nested containers, because the CacheNode
+    instances hold references to them"""
+    for key in [key for key in target if key not in source and key not in skip]:
+        del target[key]
+
+    for key, value in source.items():
+        current = target.get(key)
+        if key in skip or current is value:
+            continue
+        if isinstance(current, dict) and isinstance(value, dict):
+            _update_in_place(current, value)
+        elif isinstance(current, list) and isinstance(value, list):
+            current[:] = value
+        else:
+            target[key] = value
+
+def _atomic_write(file_path: str, content):
+    """Write the content into a temp file next to the target and rename it over the target
+
+    Returns:
+        int: length of the content
+    """
+    mode = 'wb' if isinstance(content, (bytes, bytearray)) else 'w'
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(file_path)),
+                                    prefix = '.' + os.path.basename(file_path) + '.')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+    except:
+        os.remove(tmp_path)
+        raise
+    return len(content)
+
+
+class FileStorage(object):
+    """Keeps the whole hub data in one file, every write dumps everything
+
+    In indexed mode (used by the lazy hubs) the byte offset of every top level node is written to an index file
+    (the cache file path with '.index' suffix) next to the cache file, so the nodes can be decoded one by one and the
+    not decoded ones are copied back to the new file as they are. The indexed mode needs JSON serializer.
+
+    Args:
+        file_path (str):
+        indexed (bool): write and use the node offset index
+        serializer (CacheSerializer): the format of the written file, JSON by default. The JSON files and the files of
+                                      this format can be read.
+        allowed_formats (iterable): names of the other formats can be read (eg 'pickle' to migrate a pickle cache),
+                                    only for trusted files, because the pickle and the marshal can run code
+    """
+
+    bytes_written = 0
+
+    def __init__(self, file_path: str, indexed = False, serializer: CacheSerializer = None, allowed_formats = None):
+        self._serializer = serializer or JSONSerializer()
+        self._allowed_formats = readable_formats(self._serializer, allowed_formats)
+        if indexed and self._serializer.name != JSONSerializer.name:
+            raise ValueError("The indexed mode needs JSON serializer")
+        self.file_path = file_path
+        self.index_path = file_path + '.index'
+        self._indexed = indexed
+        self._offsets = {} # not decoded node name -> (offset, length)
+
+    def load(self):
+        """Returns the stored data or None if there is nothing stored yet"""
+        if not os.path.isfile(self.file_path):
+            return None
+        logger.debug("Load file content from '%s'", self.file_path)
+        with open(self.file_path, 'rb') as f:
+            return loads(f.read(), self._allowed_formats)
+
+    def load_lazy(self):
+        """Read only the list of the stored nodes
+
+        Returns:
+            tuple: the already decoded data (if there is no usable index, everything) and the names of the nodes
+                   can be loaded by load_node
+        """
+        if not os.path.isfile(self.file_path):
+            return None, []
+
+        offsets = self._read_index()
+        if offsets is None:
+            logger.debug("There is no valid index for '%s'", self.file_path)
+            return self.load(), []
+
+        self._offsets = offsets
+        return {}, list(offsets)
+
+    def load_node(self, name: str):
+        offset, length = self._offsets.pop(name)
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode('utf-8'))
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        stat = os.stat(self.file_path)
+        if index.get('size') != stat.st_size or index.get('mtime') != stat.st_mtime_ns:
+            return None
+
+        return {name: tuple(pos) for name, pos in index['nodes'].items()}
+
+    def write(self, data, changes: OrderedDict):
+        """
+        Args:
+            data: the full hub data
+            changes (OrderedDict): node path -> node data, the nodes saved since the last write, in save order
+        """
+        logger.debug("Write cache to %s", self.file_path)
+        if self._indexed and isinstance(data, dict):
+            self._write_indexed(data)
+            return
+
+        content = dumps(self._serializer, data)
+        with open(self.file_path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        self.bytes_written += len(content)
+
+    def _write_indexed(self, data: dict):
+        # with the encoder of the JSONSerializer
+        raw_nodes = OrderedDict((name, self._serializer.encode(value).encode('utf-8')) for name, value in data.items())
+
+        if self._offsets:
+            with open(self.file_path, 'rb') as f:
+                for name, (offset, length) in self._offsets.items():
+                    f.seek(offset)
+                    raw_nodes[name] = f.read(length)
+
+        # the same layout as json.dump generates
+        content = bytearray(b'{')
+        offsets = {}
+        for name, raw in raw_nodes.items():
+            if len(content) > 1:
+                content += b', '
+            content += json.dumps(name).encode('utf-8') + b': '
+            offsets[name] = (len(content), len(raw))
+            content += raw
+        content += b'}'
+
+        self.bytes_written += _atomic_write(self.file_path, content)
+
+        stat = os.stat(self.file_path)
+        self.bytes_written += _atomic_write(self.index_path, json.dumps(dict(size = stat.st_size, mtime = stat.st_mtime_ns, nodes = offsets)))
+
+        self._offsets = {name: offsets[name] for name in self._offsets}
+
+
+class JournalFileStorage(FileStorage):
+    """Append-only storage: the saved nodes are appended to a journal file as delta records and the snapshot file
+    is rewritten only when the journal grows past compact_ratio * snapshot size.
+
+    The journal is the snapshot path with a '.journal' suffix. With JSON serializer it contains one JSON encoded
+    [path, data] record per line, with the others a header and length prefixed encoded records.
+
+    Args:
+        file_path (str): path of the snapshot
+        compact_ratio (float): journal size / snapshot size ratio to trigger a compaction in background
+        serializer (CacheSerializer): see FileStorage
+        allowed_formats (iterable): see FileStorage
+    """
+
+    record_header = struct.Struct('>I')
+
+    def __init__(self, file_path: str, compact_ratio: float = 1, serializer: CacheSerializer = None,
+                 allowed_formats = None):
+        super(JournalFileStorage, self).__init__(file_path, serializer = serializer, allowed_formats = allowed_formats)
+        self.journal_path = file_path + '.journal'
+        self._compact_ratio = compact_ratio
+        self._lock = Lock()
+        self._data = None
+        self._compactor = None
+
+    def _read_records(self, content, serializer, offset):
+        """Generates the encoded records and the end offset of them, stops at the incomplete last record"""
+        if serializer is None:
+            for line in content[offset:].splitlines(True):
+                if not line.endswith(b'\n'):
+                    return
+                offset += len(line)
+                yield line, offset
+            return
+
+        while offset < len(content):
+            if offset + self.record_header.size > len(content):
+                return
+            size, = self.record_header.unpack_from(content, offset)
+            offset += self.record_header.size + size
+            if offset > len(content):
+                return
+            yield content[offset - size:offset], offset
+
+    def load(self):
+        data = super(JournalFileStorage, self).load()
+        if not os.path.isfile(self.journal_path):
+            return data
+
+        logger.debug("Replay journal '%s'", self.journal_path)
+        with open(self.journal_path, 'rb') as f:
+            content = f.read()
+
+        serializer, records = split_header(content, self._allowed_formats)
+        valid_size = len(content) - len(records)
+        for record, end in self._read_records(content, serializer, valid_size):
+            try:
+                path, value = (serializer or JSONSerializer()).decode(record)
+                data, _ = _set_path({} if data is None else data, path, value, True)
+            except Exception:
+                # a complete but invalid record, the later ones are still valid
+                logger.exception("Skip the broken record in '%s' at %s", self.journal_path, valid_size)
+            valid_size = end
+
+        if valid_size < len(content) or (content and (serializer or JSONSerializer()).name != self._serializer.name):
+            # the process died in the middle of an append (the records after this would be unreachable)
+            # or the journal was written in a different format
+            logger.warning("Rewrite the snapshot '%s' from the valid journal records", self.file_path)
+            self._data = data
+            self._compact()
+
+        return data
+
+    def _encode_record(self, path, value):
+        if self._serializer.name == JSONSerializer.name:
+            # one line, the JSON encoder does not indent
+            return (self._serializer.encode([path, value]) + '\n').encode('utf-8')
+        record = self._serializer.encode([path, value])
+        return self.record_header.pack(len(record)) + record
+
+    def write(self, data, changes: OrderedDict):
+        with self._lock:
+            self._data = data
+            if not os.path.isfile(self.file_path):
+                self._compact()
+                return
+
+            if not changes:
+                return
+
+            logger.debug("Append %s record(s) to %s", len(changes), self.journal_path)
+            with open(self.journal_path, 'ab') as f:
+                if f.tell() == 0:
+                    f.write(header(self._serializer))
+                records = b''.join(self._encode_record(path, value) for path, value in changes.items())
+                f.write(records)
+                journal_size = f.tell()
+            self.bytes_written += len(records)
+
+            if journal_size > os.path.getsize(self.file_path) * self._compact_ratio:
+                self._start_compaction()
+
+    def _start_compaction(self):
+        if self._compactor and self._compactor.is_alive():
+            return
+        self._compactor = Thread(target = self.compact)
+        self._compactor.daemon = True
+        self._compactor.start()
+
+    def compact(self, data = None):
+        """Rewrite the snapshot with the current data and truncate the journal"""
+        with self._lock:
+            if data is not None:
+                self._data = data
+            self._compact()
+
+    def _compact(self):
+        logger.debug("Compact journal %s into %s", self.journal_path, self.file_path)
+        self.bytes_written += _atomic_write(self.file_path, dumps(self._serializer, {} if self._data is None else self._data))
+        with open(self.journal_path, 'w'):
+            pass
+
+
+class ShardedFileStorage(object):
+    """Keeps every top level node in its own file in a directory and writes only the nodes saved since the last
+    write, each one atomically (temp file + rename).
+
+    The root data must be a dict. The shard file name is the url quoted node name with '.json' extension if the
+    serializer is JSON, '.cache' otherwise.
+
+    Args:
+        dir_path (str): the cache directory, will be created at the first write
+        serializer (CacheSerializer): see FileStorage
+        allowed_formats (iterable): see FileStorage
+    """
+
+    extensions = ('.json', '.cache')
+    bytes_written = 0
+
+    def __init__(self, dir_path: str, serializer: CacheSerializer = None, allowed_formats = None):
+        self.dir_path = dir_path
+        self._serializer = serializer or JSONSerializer()
+        self._allowed_formats = readable_formats(self._serializer, allowed_formats)
+        self._extension = '.json' if self._serializer.name == JSONSerializer.name else '.cache'
+        self._files = {} # node name -> shard file name
+
+    def _list_shards(self):
+        self._files = {}
+        for filename in os.listdir(self.dir_path):
+            name, extension = os.path.splitext(filename)
+            if extension in self.extensions:
+                self._files[unquote(name)] = filename
+
+    def load(self):
+        if not os.path.isdir(self.dir_path):
+            return None
+        self._list_shards()
+        return {name: self.load_node(name) for name in self._files}
+
+    def load_lazy(self):
+        if not os.path.isdir(self.dir_path):
+            return None, []
+        self._list_shards()
+        return {}, list(self._files)
+
+    def load_node(self, name: str):
+        logger.debug("Load shard '%s' from '%s'", name, self.dir_path)
+        with open(os.path.join(self.dir_path, self._files[name]), 'rb') as f:
+            return loads(f.read(), self._allowed_formats)
+
+    def write(self, data, changes: OrderedDict):
+        if not isinstance(data, dict):
+            raise TypeError("The root data of a sharded cache must be a dict, got {}".format(type(data).__name__))
+
+        if '' in changes:
+            dirty = set(self._files) | set(data)
+        else:
+            dirty = set(path.split('.', 1)[0] for path in changes)
+
+        if not dirty:
+            return
+
+        if not os.path.isdir(self.dir_path):
+            os.makedirs(self.dir_path)
+
+        logger.debug("Write %s shard(s) to %s", len(dirty), self.dir_path)
+        for name in dirty:
+            old_filename = self._files.pop(name, None)
+            if name in data:
+                filename = quote(name, safe = '') + self._extension
+                self.bytes_written += _atomic_write(os.path.join(self.dir_path, filename),
+                                                    dumps(self._serializer, data[name]))
+                self._files[name] = filename
+                if old_filename in (None, filename):
+                    continue
+            if old_filename is not None:
+                os.remove(os.path.join(self.dir_path, old_filename))
+
+
+class LockedFileStorage(FileStorage):
+    """Single file storage shared by multiple processes
+
+    Every write takes an exclusive fcntl lock on the lock file (the cache file path with '.lock' suffix), which
+    contains a generation counter incremented by every write. If the generation moved since the last read of this
+    process, the file is re-read and only the changed node paths of this process are applied to it before the atomic
+    write (the missing parents of the paths are copied from the local data). The readers can check the counter under a shared lock to decide to reload the file.
+
+    Args:
+        file_path (str):
+        serializer (CacheSerializer): see FileStorage
+        allowed_formats (iterable): see FileStorage
+    """
+
+    def __init__(self, file_path: str, serializer: CacheSerializer = None, allowed_formats = None):
+        if fcntl is None:
+            raise NotImplementedError("The multi-process mode needs the fcntl module")
+        super(LockedFileStorage, self).__init__(file_path, serializer = serializer, allowed_formats = allowed_formats)
+        self.lock_path = file_path + '.lock'
+        self._generation = None
+
+    @contextmanager
+    def _locked(self, operation):
+        with open(self.lock_path, 'a+') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                f.seek(0)
+                content = f.read().strip()
+                yield f, int(content) if content else 0
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def load(self):
+        with self._locked(fcntl.LOCK_SH) as (_, generation):
+            self._generation = generation
+            return super(LockedFileStorage, self).load()
+
+    def refresh(self):
+        """Returns the stored data if it was written by another process since the last read, None otherwise"""
+        with self._locked(fcntl.LOCK_SH) as (_, generation):
+            if generation == self._generation:
+                return None
+            logger.debug("Generation of '%s' moved from %s to %s", self.file_path, self._generation, generation)
+            self._generation = generation
+            return super(LockedFileStorage, self).load()
+
+    def write(self, data, changes: OrderedDict):
+        """
+        Returns:
+            the merged data if the file was written by another process since the last read, None otherwise
+        """
+        merged = None
+        with self._locked(fcntl.LOCK_EX) as (lock_file, generation):
+            if generation != self._generation:
+                logger.debug("Merge %s changed node(s) into '%s'", len(changes), self.file_path)
+                merged = super(LockedFileStorage, self).load()
+                for path, value in changes.items():
+                    merged = _merge_path({} if merged is None else merged, data, path, value)
+                data = {} if merged is None else merged
+
+            logger.debug("Write cache to %s", self.file_path)
+            self.bytes_written += _atomic_write(self.file_path, dumps(self._serializer, data))
+
+            self._generation = generation + 1
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(self._generation))
+            lock_file.flush()
+
+        return merged
+
+
 class FileCacheHub(object):
     """Shared cache manager
 
     Args:
         cache_file_path (str):
         write_delay_timeout (float): delaying the file write (see JobDelayer)
+        journal (bool): append only the saved nodes to a journal file instead of rewriting the whole cache file
+                        (see JournalFileStorage)
+        compact_ratio (float): in journal mode, rewrite the cache file in background if the journal is bigger than
+                               compact_ratio * size of the cache file
+        sharded (bool): cache_file_path is a directory and every top level node is stored in its own file, only the
+                        changed nodes are written (see ShardedFileStorage)
+        lazy (bool): decode a top level node only when it is requested first, the untouched nodes are written back
+                     without re-encoding. In single file mode an index of the node offsets is kept next to the cache
+                     file. Cannot be combined with the journal mode.
+        multiprocess (bool): the cache file is shared between processes, the flushes are serialized with a file lock
+                             and merge the saved nodes into the latest file content (see LockedFileStorage).
+                             Cannot be combined with the other modes.
+        serializer (CacheSerializer): format of the written files, JSON by default (see cache_serializers). The JSON
+                                      files and the files of this format can be loaded.
+        allowed_formats (iterable): names of the other formats can be loaded (see FileStorage)
+        stats_callback (callable): called with the result of stats() after every flush
+        write_max_delay (float): the file write happens at most this seconds after the first not written save, even if
+                                 the saves come more often than the write_delay_timeout (see JobDelayer)
+        loop (asyncio.AbstractEventLoop): delay the file write in this event loop instead of the shared scheduler
+                                          thread (see AsyncJobDelayer), the saves must be called from the loop
 
     Example:
         from voidpp_tools.cache import FileCacheHub, CacheNode
@@ -72,48 +592,250 @@ class FileCacheHub(object):
         # content of /tmp/mycache.json will be: '[42]'
     """
 
-    def __init__(self, cache_file_path: str, write_delay_timeout: float = 1):
+    # a failed delayed flush keeps the changes and is retried after flush_retry_backoff seconds, doubled at every
+    # failure up to flush_retry_max_backoff, at most flush_retry_limit times, then only the next save retries it
+    flush_retry_limit = 5
+    flush_retry_backoff = 1
+    flush_retry_max_backoff = 60
+
+    def __init__(self, cache_file_path: str, write_delay_timeout: float = 1, journal = False, compact_ratio: float = 1,
+                 sharded = False, lazy = False, multiprocess = False, serializer: CacheSerializer = None,
+                 stats_callback: callable = None, write_max_delay: float = None, loop = None, allowed_formats = None):
         logger.debug("Initialize FileCacheHub cache_file_path: %s, write_delay_timeout: %s", cache_file_path, write_delay_timeout)
         self._cache_file_path = cache_file_path
-        self._data = {}
-        if os.path.isfile(cache_file_path):
-            logger.debug("Load file content from '%s'", cache_file_path)
-            with open(cache_file_path) as f:
-                self._data = json.load(f)
+        self._stats_callback = stats_callback
+        self._flush_times = Histogram()
+        self._flush_count = 0
+        self._flush_failures = 0
+        self._flush_error_count = 0
+        self._last_flush_error = None
+        self._retry_call = None
+        self._save_count = 0
+        self._node_reads = {}
+        self._node_writes = {}
+        self._node_hits = {}
+        self._node_misses = {}
+        load_start = time.perf_counter()
+        self._storage = self._create_storage(journal = journal, compact_ratio = compact_ratio, sharded = sharded,
+                                             lazy = lazy, multiprocess = multiprocess, serializer = serializer,
+                                             allowed_formats = allowed_formats)
+        if lazy:
+            data, names = self._storage.load_lazy()
+        else:
+            data, names = self._storage.load(), []
+        self._data = {} if data is None else data
+        self._unloaded = set(names)
+        self._load_time = time.perf_counter() - load_start
+        self._changes = OrderedDict()
+        self._lock = RLock()
+        self._flush_lock = Lock()
 
-        self._delayed_writer = JobDelayer(self.flush, write_delay_timeout)
+        if loop is None:
+            self._delayed_writer = JobDelayer(self.flush, write_delay_timeout, write_max_delay)
+        else:
+            self._delayed_writer = AsyncJobDelayer(self.flush, write_delay_timeout, write_max_delay, loop)
+
+    def _create_storage(self, journal, compact_ratio, sharded, lazy, multiprocess, serializer, allowed_formats):
+        if journal and sharded:
+            raise ValueError("The journal and sharded modes cannot be combined")
+        if journal and lazy:
+            raise ValueError("The journal and lazy modes cannot be combined")
+        if multiprocess and (journal or sharded or lazy):
+            raise ValueError("The multiprocess mode cannot be combined with the other modes")
+        if multiprocess:
+            return LockedFileStorage(self._cache_file_path, serializer, allowed_formats)
+        if sharded:
+            return ShardedFileStorage(self._cache_file_path, serializer, allowed_formats)
+        if journal:
+            return JournalFileStorage(self._cache_file_path, compact_ratio, serializer, allowed_formats)
+        return FileStorage(self._cache_file_path, indexed = lazy, serializer = serializer,
+                           allowed_formats = allowed_formats)
 
     def flush(self):
-        logger.debug("Write cache to %s", self._cache_file_path)
-        with open(self._cache_file_path, 'w') as f:
-            json.dump(self._data, f)
+        with self._flush_lock:
+            start = time.perf_counter()
+            with self._lock:
+                changes, self._changes = self._changes, OrderedDict()
+            try:
+                merged = self._storage.write(self._data, changes)
+            except Exception as e:
+                # keep the unwritten changes for the next flush, before the ones saved since
+                with self._lock:
+                    newer, self._changes = self._changes, changes
+                    for path, data in newer.items():
+                        self._record_change(path, data)
+                self._flush_failed(e)
+                raise
+            self._flush_failures = 0
+            if self._retry_call is not None:
+                self._retry_call.cancel()
+            if merged is not None:
+                self._update_data(merged)
+            self._flush_times.add(time.perf_counter() - start)
+            self._flush_count += 1
 
-    def _set_data(self, path: str, value, force):
-        if path:
-            data = self._data
-            parts = path.split('.')
+        if self._stats_callback:
+            try:
+                self._stats_callback(self.stats())
+            except Exception:
+                logger.exception("Error occured in the stats callback")
 
-            for part in parts[:-1]:
-                if part not in data:
-                    data[part] = {}
-                data = data[part]
+    def _flush_failed(self, error):
+        self._flush_failures += 1
+        self._flush_error_count += 1
+        self._last_flush_error = error
+        if not self._delayed_writer.timeout:
+            # the synchronous flush raises to the saver
+            return
+        if self._flush_failures > self.flush_retry_limit:
+            logger.error("Cannot write '%s' (%s failures), the changes are kept until the next save: %s",
+                         self._cache_file_path, self._flush_failures, error)
+            return
+        delay = min(self.flush_retry_backoff * 2 ** (self._flush_failures - 1), self.flush_retry_max_backoff)
+        logger.warning("Cannot write '%s', retry in %s seconds: %s", self._cache_file_path, delay, error)
+        if self._retry_call is None:
+            self._retry_call = get_scheduler().create(self._retry_flush)
+        self._retry_call.schedule_later(delay)
 
-            last_part = parts[-1:][0]
+    def _retry_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            # logged and counted by the flush
+            pass
 
-            if last_part not in data or force:
-                data[last_part] = value
+    def stats(self):
+        """Counters of the hub, to tune the write_delay_timeout or the storage mode
 
-            data = data[last_part]
+        Returns:
+            dict:
+                load_time: seconds spent on loading the storage in the constructor
+                flush_count: number of the flushes
+                flush_time: histogram of the flush durations in seconds (see stats.Histogram.as_dict)
+                bytes_written: bytes written by the storage
+                save_count: number of the save_node_data calls
+                saves_per_flush: save_count / flush_count, the coalescing ratio of the delayed writer
+                hits: number of the found entries of the lookups of the cache nodes (eg LRUCacheNode.get)
+                misses: number of the missing or expired entries of the lookups
+                nodes: top level node name -> dict(reads, writes, hits, misses). The reads and the writes are the
+                       get_node_data (ie the node constructions) and the save_node_data calls, the hits and the misses
+                       are counted by count_lookup
+                flush_error_count: number of the failed flushes
+                last_flush_error: the exception of the last failed flush, None if the last flush succeeded
+        """
+        counters = dict(reads = self._node_reads, writes = self._node_writes, hits = self._node_hits,
+                        misses = self._node_misses)
+        with self._lock:
+            names = set().union(*counters.values())
+            nodes = {name: {key: values.get(name, 0) for key, values in counters.items()} for name in names}
+            hits = sum(self._node_hits.values())
+            misses = sum(self._node_misses.values())
+        return dict(
+            load_time = self._load_time,
+            flush_count = self._flush_count,
+            flush_time = self._flush_times.as_dict(),
+            bytes_written = getattr(self._storage, 'bytes_written', 0),
+            save_count = self._save_count,
+            saves_per_flush = self._save_count / self._flush_count if self._flush_count else None,
+            hits = hits,
+            misses = misses,
+            nodes = nodes,
+            flush_error_count = self._flush_error_count,
+            last_flush_error = self._last_flush_error if self._flush_failures else None,
+        )
 
+    def refresh(self):
+        """Reload the data written by other processes in multiprocess mode
+
+        The saved but not flushed nodes are kept. It is cheap if nothing has changed since the last read or write.
+        """
+        if not isinstance(self._storage, LockedFileStorage):
+            return
+        with self._flush_lock:
+            data = self._storage.refresh()
+            if data is not None:
+                self._update_data(data)
+
+    def _update_data(self, data):
+        with self._lock:
+            if '' in self._changes:
+                return
+            if isinstance(self._data, dict) and isinstance(data, dict):
+                _update_in_place(self._data, data, set(path.split('.', 1)[0] for path in self._changes))
+            elif isinstance(self._data, list) and isinstance(data, list):
+                self._data[:] = data
+            else:
+                self._data = data
+
+    def compact(self):
+        """Rewrite the snapshot of a journaled hub synchronously"""
+        if isinstance(self._storage, JournalFileStorage):
+            with self._flush_lock:
+                self._storage.compact(self._data)
+
+    def _load_nodes(self, names):
+        for name in names:
+            if name in self._unloaded:
+                self._data[name] = self._storage.load_node(name)
+                self._unloaded.discard(name)
+
+    def _set_data(self, path: str, value, force):
+        with self._lock:
+            counters = self._node_writes if force else self._node_reads
+            name = path.split('.', 1)[0]
+            counters[name] = counters.get(name, 0) + 1
+            if force:
+                self._save_count += 1
+            if self._unloaded:
+                self._load_nodes([path.split('.', 1)[0]] if path else list(self._unloaded))
+            self._data, data = _set_path(self._data, path, value, force)
+            if force:
+                self._record_change(path, data)
+            elif data is value and value is not None and path not in self._changes and \
+                    not isinstance(self._storage, LockedFileStorage):
+                # the default data became the node, it will be written with the next flush (the multiprocess merge
+                # creates it from the local data, a whole node write would drop the keys of the other processes)
+                self._changes[path] = data
             return data
-        else:
-            if not self._data or force:
-                self._data = value
-            return self._data
+
+    def _record_change(self, path: str, data):
+        parent, _, index = path.rpartition('.')
+        if index.isdigit():
+            prefix = parent + '.' if parent else ''
+            pending = [key for key in self._changes if key.startswith(prefix)]
+            later = [key for key in pending if key[len(prefix):].split('.', 1)[0].isdigit() and
+                     int(key[len(prefix):].split('.', 1)[0]) > int(index)]
+            parent_data = _set_path(self._data, parent, None, False)[1]
+            if later and isinstance(parent_data, list):
+                # moving the item after the higher indexes would break the replay (eg the append of the next index),
+                # so the whole list is saved instead
+                for key in pending:
+                    del self._changes[key]
+                self._record_change(parent, parent_data)
+                return
+
+        # the latest save of a path must be the last record in the journal
+        self._changes.pop(path, None)
+        self._changes[path] = data
 
     def get_node_data(self, path = '', default = None):
         return self._set_data(path, default, False)
 
+    def count_lookup(self, path: str, hit: bool):
+        """Count a hit or a miss of a lookup in a cache node, see stats()"""
+        name = path.split('.', 1)[0]
+        with self._lock:
+            counters = self._node_hits if hit else self._node_misses
+            counters[name] = counters.get(name, 0) + 1
+
+    def is_encodable(self, data):
+        """Whether the serializer of the hub can write the data (eg a set cannot be written as JSON)"""
+        try:
+            self._storage._serializer.encode(data)
+        except Exception:
+            return False
+        return True
+
     def save_node_data(self, path: str, data):
         self._set_data(path, data, True)
 
@@ -149,3 +871,332 @@ class SimpleCache(CacheNode):
 
     def __init__(self, cache_file_path, default_data, write_delay_timeout = 1):
         super().__init__('', default_data, FileCacheHub(cache_file_path, write_delay_timeout))
+
+
+class LRUCacheNode(CacheNode):
+    """Bounded key-value cache node with least recently used eviction and per entry expiration
+
+    The entries are stored in the hub as an ordered mapping of key -> [value, expiration timestamp or None], the least
+    recently used first, so the recency order survives the restarts. The hits only reorder the entries in memory, the
+    order is stored with the next change (set, delete, eviction or expiration). With JSON storage the keys must be
+    strings.
+
+    The expired entries are removed when they are accessed, and periodically if sweep_interval is given.
+
+    Args:
+        path (str): see CacheNode
+        hub (FileCacheHub):
+        max_entries (int): maximum number of entries
+        max_bytes (int): maximum approximate size of the entries (the length of the JSON encoded values and keys)
+        ttl (float): default time to live of the entries in seconds, None means never expire
+        sweep_interval (float): remove the expired entries in a background Timer in every sweep_interval seconds
+
+    Example:
+        from voidpp_tools.cache import FileCacheHub, LRUCacheNode
+
+        hub = FileCacheHub('/tmp/mycache.json')
+        users = LRUCacheNode('users', hub, max_entries = 1000, ttl = 3600)
+
+        users.set('douglas', {'answer': 42})
+        users.get('douglas')
+    """
+
+    def __init__(self, path, hub: FileCacheHub, max_entries: int = None, max_bytes: int = None, ttl: float = None,
+                 sweep_interval: float = None):
+        super().__init__(path, OrderedDict(), hub)
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = RLock()
+
+        changed = False
+        if not isinstance(self._data, OrderedDict):
+            # loaded from the storage, the mapping order is the recency order
+            self._data = OrderedDict(self._data)
+            changed = True
+
+        self._sizes = {key: self._entry_size(key, entry[0]) for key, entry in self._data.items()}
+        self._bytes = sum(self._sizes.values())
+
+        if self._evict() or changed:
+            self.save()
+
+        self._sweeper = None
+        if sweep_interval:
+            self._sweeper = Timer(sweep_interval, self.sweep)
+            self._sweeper.start()
+
+    @staticmethod
+    def _entry_size(key, value):
+        return len(key) + len(json.dumps(value, default = repr))
+
+    @staticmethod
+    def _is_expired(entry, now):
+        return entry[1] is not None and entry[1] <= now
+
+    def _remove(self, key):
+        del self._data[key]
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        evicted = 0
+        while self._data and ((self._max_entries is not None and len(self._data) > self._max_entries) or
+                              (self._max_bytes is not None and self._bytes > self._max_bytes)):
+            self._remove(next(iter(self._data)))
+            evicted += 1
+        return evicted
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._hub.count_lookup(self._path, False)
+                return default
+            if self._is_expired(entry, time.time()):
+                self._hub.count_lookup(self._path, False)
+                self._remove(key)
+                self.save()
+                return default
+            self._hub.count_lookup(self._path, True)
+            # saved with the next change, a write per hit would cost more than the lookup
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Args:
+            key (str):
+            value:
+            ttl (float): time to live in seconds, the default is the ttl of the node
+        """
+        ttl = self._ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = [value, None if ttl is None else time.time() + ttl]
+            self._sizes[key] = self._entry_size(key, value)
+            self._bytes += self._sizes[key]
+            self._evict()
+            self.save()
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._remove(key)
+            self.save()
+            return True
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and not self._is_expired(entry, time.time())
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            self.save()
+
+    def sweep(self):
+        """Remove the expired entries
+
+        Returns:
+            int: number of the removed entries
+        """
+        with self._lock:
+            now = time.time()
+            expired = [key for key, entry in self._data.items() if self._is_expired(entry, now)]
+            for key in expired:
+                self._remove(key)
+            if expired:
+                self.save()
+            return len(expired)
+
+    def close(self):
+        """Stop the periodic sweep"""
+        if self._sweeper:
+            self._sweeper.stop()
+
+
+
+class DictCacheNode(CacheNode, MutableMapping):
+    """Dict node which saves itself on every change through the mapping interface
+
+    Only the changed keys are handed to the hub (as 'path.key' node paths), so the journal and the multiprocess modes
+    write only them. The deletes and the keys which cannot be a path part (not str or contains '.') save the whole
+    node. The in place changes of the values are not detected, call touch(key) after them.
+
+    Example:
+        from voidpp_tools.cache import FileCacheHub, DictCacheNode
+
+        settings = DictCacheNode('settings', FileCacheHub('/tmp/mycache.json'))
+        settings['answer'] = 42
+    """
+
+    def __init__(self, path, hub: FileCacheHub, default_data: dict = None):
+        super().__init__(path, {} if default_data is None else default_data, hub)
+
+    def touch(self, key):
+        """Save the value of the key"""
+        if isinstance(key, str) and key and '.' not in key:
+            self._hub.save_node_data(self._path + '.' + key if self._path else key, self._data[key])
+        else:
+            self.save()
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self.touch(key)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self.save()
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ListCacheNode(CacheNode, MutableSequence):
+    """List node which saves itself on every change through the sequence interface
+
+    Only the changed items are handed to the hub on item set and append (as 'path.index' node paths), the other
+    changes (insert, delete, slice assignment) save the whole node. The in place changes of the items are not
+    detected, call touch(index) after them.
+    """
+
+    def __init__(self, path, hub: FileCacheHub, default_data: list = None):
+        super().__init__(path, [] if default_data is None else default_data, hub)
+
+    def touch(self, index: int):
+        """Save the item at the index"""
+        index = index + len(self._data) if index < 0 else index
+        self._hub.save_node_data('{}.{}'.format(self._path, index) if self._path else str(index), self._data[index])
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        self._data[index] = value
+        if isinstance(index, slice):
+            self.save()
+        else:
+            self.touch(index)
+
+    def __delitem__(self, index):
+        del self._data[index]
+        self.save()
+
+    def __len__(self):
+        return len(self._data)
+
+    def insert(self, index, value):
+        if index >= len(self._data):
+            self._data.append(value)
+            self.touch(len(self._data) - 1)
+        else:
+            self._data.insert(index, value)
+            self.save()
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+class _PendingCall(object):
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+def cached(hub: FileCacheHub, path: str = None, ttl: float = None, maxsize: int = None):
+    """Persistent memoization decorator, the results are stored in an LRUCacheNode of the hub
+
+    The key of a call is the hash of the JSON encoded arguments (the not JSON serializable arguments are represented
+    by their repr, so they must have a stable one). If the function is called with the same arguments from more
+    threads at the same time, only the first call runs, the others wait for its result. The results the serializer
+    of the hub cannot encode are returned, but not cached.
+
+    The decorated function has cache_info() and cache_clear() like the functools.lru_cache.
+
+    Args:
+        hub (FileCacheHub):
+        path (str): node path of the results, default is made from the module and the name of the function
+        ttl (float): time to live of the results in seconds
+        maxsize (int): maximum number of the stored results
+
+    Example:
+        from voidpp_tools.cache import FileCacheHub, cached
+
+        hub = FileCacheHub('/tmp/mycache.json')
+
+        @cached(hub, ttl = 3600)
+        def fetch_user(name):
+            return HTTP.load_json('http://example.com/users/' + name)
+    """
+
+    def decorator(func):
+        node_path = path or '{}:{}'.format(func.__module__, getattr(func, '__qualname__', func.__name__)).replace('.', '/')
+        node = LRUCacheNode(node_path, hub, max_entries = maxsize, ttl = ttl)
+        missing = object()
+        pending = {}
+        lock = Lock()
+        stats = dict(hits = 0, misses = 0)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = hashlib.sha1(json.dumps([args, kwargs], sort_keys = True, default = repr).encode('utf-8')).hexdigest()
+
+            with lock:
+                result = node.get(key, missing)
+                if result is not missing:
+                    stats['hits'] += 1
+                    return result
+                stats['misses'] += 1
+                call = pending.get(key)
+                owner = call is None
+                if owner:
+                    call = pending[key] = _PendingCall()
+
+            if not owner:
+                call.event.wait()
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+            try:
+                call.result = func(*args, **kwargs)
+                if hub.is_encodable(call.result):
+                    node.set(key, call.result)
+                else:
+                    # it would break every flush of the hub
+                    logger.warning("The result of %s cannot be encoded, it is not cached", func.__name__)
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with lock:
+                    del pending[key]
+                call.event.set()
+
+        def cache_info():
+            return CacheInfo(stats['hits'], stats['misses'], maxsize, len(node))
+
+        def cache_clear():
+            with lock:
+                node.clear()
+                stats.update(hits = 0, misses = 0)
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,200 @@
+import abc
+import json
+import marshal
+import pickle
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+HEADER_MAGIC = b'VPTC'
+
+class UnknownSerializerException(Exception):
+    pass
+
+class ForbiddenSerializerException(Exception):
+    pass
+
+class CacheSerializer(object):
+    """Encode/decode interface of the cache storages
+
+    The name of the serializer is recorded in the header of the cache files, so the files written with an other
+    serializer can be loaded too. The JSON based formats are always accepted, the others (which can run code, like
+    pickle) only if they are allowed (see split_header).
+    """
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+
+    @abc.abstractmethod
+    def encode(self, data):
+        """
+            Args:
+                data: the cache data
+
+            Returns:
+                The encoded bytes (or str for text formats)
+        """
+        pass
+
+    @abc.abstractmethod
+    def decode(self, data):
+        """
+            Args:
+                data (bytes): the encoded data, without the header
+
+            Returns:
+                The cache data
+        """
+        pass
+
+class JSONSerializer(CacheSerializer):
+    """The legacy format: the files written with it have no header, so they are plain JSON files
+
+    Args:
+        encoder (json.JSONEncoder): custom encoder class, eg voidpp_tools.json_encoder.JsonEncoder
+    """
+
+    name = 'json'
+
+    def __init__(self, encoder = None):
+        self._encoder = encoder
+
+    def encode(self, data):
+        return json.dumps(data, cls = self._encoder)
+
+    def decode(self, data):
+        return json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+
+class PickleSerializer(CacheSerializer):
+    """Any picklable data, with the highest protocol by default"""
+
+    name = 'pickle'
+
+    def __init__(self, protocol = pickle.HIGHEST_PROTOCOL):
+        self._protocol = protocol
+
+    def encode(self, data):
+        return pickle.dumps(data, self._protocol)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+def _to_builtin(data):
+    if isinstance(data, dict):
+        return {key: _to_builtin(value) for key, value in data.items()}
+    if isinstance(data, tuple):
+        return tuple(_to_builtin(value) for value in data)
+    if isinstance(data, list):
+        return [_to_builtin(value) for value in data]
+    return data
+
+class MarshalSerializer(CacheSerializer):
+    """The fastest one, but only for the builtin types and the format may change between python versions
+
+    The subclasses of the dict and the list (eg the OrderedDict of the LRUCacheNode) are stored as plain dicts and
+    lists.
+    """
+
+    name = 'marshal'
+
+    def encode(self, data):
+        try:
+            return marshal.dumps(data)
+        except ValueError:
+            # the subclasses are not marshallable, the conversion is skipped for the plain data
+            return marshal.dumps(_to_builtin(data))
+
+    def decode(self, data):
+        return marshal.loads(data)
+
+class CompressedSerializer(CacheSerializer):
+    """Compress the output of an other serializer
+
+    Args:
+        serializer (CacheSerializer):
+        method (str): 'zlib' or 'lzma'
+        level (int): compression level, None for the default of the method
+    """
+
+    methods = ('zlib', 'lzma')
+
+    def __init__(self, serializer: CacheSerializer, method = 'zlib', level = None):
+        if method not in self.methods:
+            raise UnknownSerializerException("Unknown compression method '{}'".format(method))
+        if method == 'lzma' and lzma is None:
+            raise UnknownSerializerException("The lzma module is not available")
+        self._serializer = serializer
+        self._method = method
+        self._level = level
+        self.name = '{}+{}'.format(serializer.name, method)
+
+    def encode(self, data):
+        encoded = self._serializer.encode(data)
+        if isinstance(encoded, str):
+            encoded = encoded.encode('utf-8')
+        if self._method == 'zlib':
+            return zlib.compress(encoded, -1 if self._level is None else self._level)
+        return lzma.compress(encoded, preset = self._level)
+
+    def decode(self, data):
+        if self._method == 'zlib':
+            return self._serializer.decode(zlib.decompress(data))
+        return self._serializer.decode(lzma.decompress(data))
+
+serializers = {
+    JSONSerializer.name: JSONSerializer,
+    PickleSerializer.name: PickleSerializer,
+    MarshalSerializer.name: MarshalSerializer,
+}
+
+def get_serializer(name: str):
+    """Create a serializer by the name recorded in a file header, eg 'pickle' or 'json+zlib'"""
+    parts = name.split('+')
+    if parts[0] not in serializers:
+        raise UnknownSerializerException("Unknown serializer '{}'".format(parts[0]))
+    serializer = serializers[parts[0]]()
+    for method in parts[1:]:
+        serializer = CompressedSerializer(serializer, method)
+    return serializer
+
+def header(serializer: CacheSerializer):
+    """The file header of the serializer. The JSON files have no header for backward compatibility."""
+    if serializer.name == JSONSerializer.name:
+        return b''
+    return HEADER_MAGIC + serializer.name.encode('ascii') + b'\n'
+
+def dumps(serializer: CacheSerializer, data):
+    """Encode the data to file content"""
+    if serializer.name == JSONSerializer.name:
+        return serializer.encode(data)
+    return header(serializer) + serializer.encode(data)
+
+def split_header(content, allowed_formats = None):
+    """
+    Args:
+        content (bytes): file content written by dumps
+        allowed_formats (iterable): names of the non-JSON formats can be decoded (eg 'pickle'), None for any
+
+    Returns:
+        tuple: the serializer of the content (None for the headerless JSON) and the content without the header
+    """
+    if content[:len(HEADER_MAGIC)] != HEADER_MAGIC:
+        return None, content
+    header_end = content.index(b'\n')
+    name = content[len(HEADER_MAGIC):header_end].decode('ascii')
+    if allowed_formats is not None and name.split('+')[0] != JSONSerializer.name and name not in allowed_formats:
+        raise ForbiddenSerializerException("The '{}' format is not allowed, use it as the serializer or add it to "
+                                           "the allowed formats".format(name))
+    return get_serializer(name), content[header_end + 1:]
+
+def loads(content, allowed_formats = None):
+    """Decode file content written by dumps, see split_header"""
+    serializer, content = split_header(content, allowed_formats)
+    return (serializer or JSONSerializer()).decode(content)
+
+def readable_formats(serializer: CacheSerializer, allowed_formats = None):
+    """The non-JSON formats a storage can load: its own one and the explicitly allowed ones"""
+    return set(allowed_formats or ()) | {serializer.name}
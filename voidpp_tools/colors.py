@@ -1,9 +1,16 @@
 
 import os
 import sys
+import atexit
 import logging
+import logging.handlers
 from datetime import datetime
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
 class Colors(object):
     green = '\033[1;32m'
     red = '\033[1;31m'
@@ -35,27 +42,72 @@ class ColorFactory(object):
 
 class ColoredLoggerFormatter(logging.Formatter):
 
+    colors = {
+        logging.ERROR: Colors.red,
+        logging.WARNING: Colors.yellow,
+        logging.INFO: Colors.default,
+        logging.DEBUG: Colors.cyan
+    }
+
     def __init__(self, debug = False):
         super(ColoredLoggerFormatter, self).__init__()
         self.debug = debug
 
     def format(self, record):
-        colors = {
-            logging.ERROR: Colors.red,
-            logging.WARNING: Colors.yellow,
-            logging.INFO: Colors.default,
-            logging.DEBUG: Colors.cyan
-        }
+        prefix = self.colors.get(record.levelno, Colors.default)
 
+        # the time of the record, it may be formatted much later in a QueueListener thread
         if self.debug:
-            msg = '%s - %s:%s: ' % (datetime.now(), record.name, record.lineno)
-            msg += Colors.default + record.getMessage()
+            msg = '%s%s - %s:%s: %s%s%s' % (prefix, datetime.fromtimestamp(record.created), record.name,
+                                            record.lineno, Colors.default, record.getMessage(), Colors.default)
         else:
-            msg = record.getMessage()
-
-        msg = colors.get(record.levelno, Colors.default) + msg + Colors.default
+            msg = prefix + record.getMessage() + Colors.default
 
         if record.exc_info:
             msg += '\n' + self.formatException(record.exc_info)
 
         return msg
+
+class QueueListener(logging.handlers.QueueListener):
+    """QueueListener can be stopped more than once (eg explicitly and at the interpreter exit), and the records are
+    passed only to the handlers with a lower or equal level (the respect_handler_level needs python 3.5)"""
+
+    def handle(self, record):
+        record = self.prepare(record)
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        if self._thread is not None:
+            super(QueueListener, self).stop()
+
+def setup_queue_logging(handlers = None, logger = None, level = logging.INFO, debug = False):
+    """Log through a queue: the logger gets a QueueHandler, and a listener thread calls the real handlers, so the
+    logging threads do not wait for the formatting and the I/O
+
+    Args:
+        handlers (list): the real handlers, default is a stderr StreamHandler with ColoredLoggerFormatter
+        logger (logging.Logger): default is the root logger, its current handlers are replaced
+        level (int): level of the logger
+        debug (bool): debug mode of the default ColoredLoggerFormatter
+
+    Returns:
+        QueueListener: the started listener, stopped (and drained) at the interpreter exit
+    """
+    if handlers is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(ColoredLoggerFormatter(debug))
+        handlers = [handler]
+
+    logger = logger or logging.getLogger()
+    queue = Queue()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(queue))
+    logger.setLevel(level)
+
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,6 +1,11 @@
 import os
 import abc
+import copy
+import logging
 from .dict_utils import recursive_update
+from .timer import IntervalJob, get_default_scheduler
+
+logger = logging.getLogger(__name__)
 
 class ConfigLoaderException(Exception):
     pass
@@ -39,8 +44,11 @@ class ConfigLoader(object):
             formatter (ConfigFormatter): config encode/decode interface instance
             base_path (str): a custom path which may be contains the config
             nested (bool): in case of true, load all the config files found in the sources and merges it
+            cache (bool): keep the content of the config files until they change (by path, mtime and size), so the
+                          load reads only the changed files. The content is decoded at every load, so the callers
+                          get their own data.
     """
-    def __init__(self, formatter, base_path, nested = False):
+    def __init__(self, formatter, base_path, nested = False, cache = True):
         self.sources = [
             os.getcwd(),
             os.path.dirname(os.path.abspath(base_path)),
@@ -50,6 +58,9 @@ class ConfigLoader(object):
         self.__loaded_config_file = None
         self.__formatter = formatter
         self.__nested = nested
+        self.__cache_enabled = cache
+        # file path -> ((path, mtime_ns, size), content)
+        self.__cache = {}
 
     @property
     def filename(self):
@@ -67,12 +78,51 @@ class ConfigLoader(object):
 
         return filenames, tries
 
+    def __get_file_keys(self, filenames):
+        keys = []
+        for filename in filenames:
+            stat = os.stat(filename)
+            keys.append((filename, stat.st_mtime_ns, stat.st_size))
+        return tuple(keys)
+
+    def get_state(self, filename):
+        """The identity of the files the load would read, it changes if any of them is added, removed or modified
+
+        Args:
+            filename (str): the filename of the config, without any path
+
+        Returns:
+            tuple: (path, mtime_ns, size) of the files
+        """
+        filenames = self.__search_config_files(filename)[0]
+        try:
+            return self.__get_file_keys(filenames if self.__nested else filenames[:1])
+        except OSError:
+            # removed since the search
+            return None
+
+    def __read_config_file(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def __read_cached_config_file(self, key):
+        filename = key[0]
+        cached = self.__cache.get(filename)
+        if cached is None or cached[0] != key:
+            cached = (key, self.__read_config_file(filename))
+            self.__cache[filename] = cached
+        return cached[1]
+
     def __load_config_files(self, filenames):
         data = dict()
 
-        for filename in filenames:
-            with open(filename) as f:
-                recursive_update(data, self.__formatter.decode(f.read()))
+        if self.__cache_enabled:
+            contents = [self.__read_cached_config_file(key) for key in self.__get_file_keys(filenames)]
+        else:
+            contents = [self.__read_config_file(filename) for filename in filenames]
+
+        for content in contents:
+            recursive_update(data, self.__formatter.decode(content))
 
         return data
 
@@ -96,7 +146,8 @@ class ConfigLoader(object):
 
         if len(filenames):
             self.__loaded_config_file = filenames if self.__nested else filenames[0]
-            return self.__load_config_files(filenames if self.__nested else filenames[:1])
+            filenames = filenames if self.__nested else filenames[:1]
+            return self.__load_config_files(filenames)
 
         if create is not None:
             self.__loaded_config_file = os.path.join(create, filename)
@@ -126,3 +177,86 @@ class ConfigLoader(object):
                 f.write(self.__formatter.encode(data))
         except Exception as e:
             raise ConfigLoaderException("Config data is not serializable: %s" % e)
+
+        # the mtime may not change if the save is fast enough
+        self.__cache.clear()
+
+    def watch(self, filename, callback = None, interval = 1):
+        """Start a ConfigWatcher for the config
+
+        Args:
+            filename (str): the filename of the config, without any path
+            callback (callable): subscriber of the watcher
+            interval (float): seconds between the checks
+
+        Returns:
+            ConfigWatcher: the started watcher
+        """
+        watcher = ConfigWatcher(self, filename, interval)
+        if callback is not None:
+            watcher.subscribe(callback)
+        watcher.start()
+        return watcher
+
+class ConfigWatcher(object):
+    """Polls the files of a config and calls the subscribers with the new config data if any of them changes
+
+    The checks run on the shared scheduler of the timer module (see timer.get_default_scheduler), so the watchers do
+    not need threads. Only the path, mtime and size of the files are checked, the files are read at a change only.
+
+    Args:
+        loader (ConfigLoader):
+        filename (str): the filename of the config, without any path
+        interval (float): seconds between the checks
+    """
+
+    def __init__(self, loader, filename, interval = 1):
+        self.loader = loader
+        self.filename = filename
+        self._subscribers = []
+        self._state = loader.get_state(filename)
+        self._job = IntervalJob(get_default_scheduler(), interval, self.check)
+
+    def subscribe(self, callback):
+        """
+        Args:
+            callback (callable): called with the new config data
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def check(self):
+        """Load the config and call the subscribers if it changed since the last check
+
+        Returns:
+            bool: True if it changed
+        """
+        state = self.loader.get_state(self.filename)
+        if state == self._state:
+            return False
+        self._state = state
+
+        try:
+            data = self.loader.load(self.filename)
+        except Exception:
+            logger.exception("Cannot reload the config '%s'", self.filename)
+            return False
+
+        for callback in list(self._subscribers):
+            try:
+                # the subscribers must not see the changes of each other
+                callback(copy.deepcopy(data))
+            except Exception:
+                logger.exception("Error occured during calling the config subscriber %s", callback)
+        return True
+
+    def start(self):
+        self._job.start()
+
+    def is_running(self):
+        return self._job.is_running()
+
+    def stop(self):
+        self._job.stop()
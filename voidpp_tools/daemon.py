@@ -1,18 +1,140 @@
 
-import sys, os, time, atexit
-from signal import SIGTERM
+import sys, os, time, atexit, signal, select, math, json, socket, subprocess, tempfile
+from signal import SIGTERM, SIGKILL, SIGHUP, SIGUSR2
+from threading import Lock, Thread, Timer
 
 from .logger_proxy import LoggerProxy
+from .job_delayer import _drain_pending_delayers
+
+def get_rss():
+    """Resident set size of the current process in bytes, from /proc/self/statm (None if not available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+def get_process_stats():
+    """Resource usage of the current process from the /proc/self (no subprocess), None for the unavailable values"""
+    stats = dict(rss = get_rss(), cpu_time = None, threads = None, fds = None)
+    try:
+        with open('/proc/self/stat') as f:
+            # the command name may contain spaces, the fields after it are fixed
+            fields = f.read().rsplit(')', 1)[1].split()
+        stats['cpu_time'] = (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+        stats['threads'] = int(fields[17])
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        stats['fds'] = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        pass
+    return stats
+
+# environment variables of the replacement process at the graceful restart
+HANDOFF_FDS_ENV = 'VOIDPP_DAEMON_FDS'
+HANDOFF_PID_ENV = 'VOIDPP_DAEMON_HANDOFF_PID'
+
+def wait_for_pid(pid, timeout = None):
+    """Wait for the exit of any process (not only of a child), with a pidfd on Linux 5.3+ and by polling otherwise
+
+    Returns:
+        bool: True if the process has exited
+    """
+    if hasattr(os, 'pidfd_open'):
+        try:
+            fd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            fd = None
+        if fd is not None:
+            try:
+                poller = select.poll()
+                poller.register(fd, select.POLLIN)
+                return bool(poller.poll(None if timeout is None else int(math.ceil(timeout * 1000))))
+            finally:
+                os.close(fd)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
 
 class Daemon(object):
     """
     A generic daemon class.
 
     Usage: subclass the Daemon class and override the run() method
+
+    In the pre-fork mode (workers > 0) the daemonized master process forks the workers, which call the worker_run()
+    method, and respawns them after they exit. The workers should call job_done() after every job and return from
+    the worker_run() when should_exit() is True, so they are recycled after max_jobs jobs or above max_rss.
+
+    At SIGTERM the shutdown() is called, which exits immediately by default. Override it to drain the work in
+    progress: the run() (or worker_run()) should return when should_exit() is True. The process (or the workers of
+    the master) is killed if it is still running stop_timeout seconds after the SIGTERM. At SIGHUP the reload() is
+    called (in the master and in every worker).
+
+    For the zero downtime restart create the listening sockets with listen() in the init(). At SIGUSR2 (sent by the
+    restart(graceful = True)) the daemon starts its replacement with the get_restart_command(), passes the listening
+    sockets to it (the pending connections wait in their backlog), and drains as at SIGTERM once the replacement has
+    written its pid into the pidfile.
+
+    With the control_socket the daemon answers the stats (uptime, resource usage, counters, heartbeat) on a unix
+    socket, see status(verbose = True). Call heartbeat() regularly in the run() to show it is not stuck, and incr() to
+    count anything. In the pre-fork mode the master answers, with its own stats and the pids of the workers.
+
+    Args:
+        pidfile (str):
+        logger (logging.Logger):
+        workers (int): number of the worker processes, 0 to call the run() in the daemon process
+        max_jobs (int): recycle the workers after this many jobs
+        max_rss (int): recycle the workers above this resident set size (bytes)
+        respawn_backoff (float): the first delay before respawning a crashed worker (or one exited in less than
+                                 min_worker_lifetime seconds), doubled at every crash in a row
+        max_respawn_backoff (float): upper limit of the respawn delay
+        stop_timeout (float): seconds to drain after the SIGTERM before the SIGKILL, None for no limit
+        control_socket (str): path of the unix socket of the stats, None to disable it
     """
-    def __init__(self, pidfile, logger):
+    def __init__(self, pidfile, logger, workers = 0, max_jobs = None, max_rss = None, respawn_backoff = 0.5,
+                 max_respawn_backoff = 30, stop_timeout = 10, control_socket = None):
         self.logger = logger
         self.pidfile = pidfile
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.respawn_backoff = respawn_backoff
+        self.max_respawn_backoff = max_respawn_backoff
+        self.stop_timeout = stop_timeout
+        self.control_socket = control_socket
+        # set in the worker processes
+        self.worker_id = None
+        self.jobs_done = 0
+        self._exiting = False
+        # name -> listening socket
+        self.sockets = {}
+        self._start_cwd = os.getcwd()
+        # the sockets passed by the daemon this process replaces
+        self._inherited_fds = json.loads(os.environ.pop(HANDOFF_FDS_ENV, '{}'))
+        self._handoff_pid = int(os.environ.pop(HANDOFF_PID_ENV, 0)) or None
+        self.counters = {}
+        self._counters_lock = Lock()
+        self._started = time.time()
+        self._last_heartbeat = None
+        self._worker_pids = {}
 
 
     def init(self):
@@ -54,15 +176,22 @@ class Daemon(object):
 
         # write pidfile
         atexit.register(self.delpid)
-        pid = str(os.getpid())
-        with open(self.pidfile,'w+') as f:
-            f.write("%s\n" % pid)
+        self.write_pid()
 
         sys.stdout = LoggerProxy(self.logger.info)
         sys.stderr = LoggerProxy(self.logger.error)
 
+    def write_pid(self):
+        """Replace the pidfile atomically, so the readers never see it empty (eg during the graceful restart)"""
+        fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(self.pidfile)), prefix = '.pid')
+        with os.fdopen(fd, 'w') as f:
+            f.write("%s\n" % os.getpid())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, self.pidfile)
+
     def delpid(self):
-        if os.path.exists(self.pidfile):
+        # after a graceful restart the pidfile belongs to the replacement
+        if self.get_pid() == os.getpid():
             os.remove(self.pidfile)
 
     def get_pid(self):
@@ -72,7 +201,7 @@ class Daemon(object):
             with open(self.pidfile, 'r') as f:
                 try:
                     pid = int(f.read().strip())
-                except TypeError as e:
+                except (TypeError, ValueError) as e:
                     pid = None
         except IOError:
             pid = None
@@ -93,15 +222,121 @@ class Daemon(object):
         else:
             return True
 
-    def status(self):
-        return 'Daemon is ' + ('running' if self.is_running() else 'not running')
+    def status(self, verbose = False):
+        """
+        Args:
+            verbose (bool): query the stats of the daemon on the control socket
+        """
+        running = self.is_running()
+        message = 'Daemon is ' + ('running' if running else 'not running')
+        if not verbose or not running or not self.control_socket:
+            return message
+
+        try:
+            stats = self.query_control('stats')
+        except (IOError, OSError, ValueError) as e:
+            return message + '\ncannot query the stats: %s' % e
+
+        lines = [message]
+        for name, value in sorted(stats.items()):
+            if isinstance(value, dict):
+                lines += ['%s.%s: %s' % (name, key, item) for key, item in sorted(value.items())]
+            else:
+                lines.append('%s: %s' % (name, value))
+        return '\n'.join(lines)
+
+    def heartbeat(self):
+        """Call it regularly in the run() (or worker_run()), its age in the stats shows if the process is stuck"""
+        self._last_heartbeat = time.time()
+
+    def incr(self, name, value = 1):
+        """Increment a counter of the stats, thread safe"""
+        with self._counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: the stats of the current process, sampled at every call
+        """
+        now = time.time()
+        stats = get_process_stats()
+        with self._counters_lock:
+            counters = dict(self.counters)
+        stats.update(
+            pid = os.getpid(),
+            uptime = now - self._started,
+            heartbeat = self._last_heartbeat,
+            heartbeat_age = None if self._last_heartbeat is None else now - self._last_heartbeat,
+            counters = counters,
+        )
+        if self._worker_pids:
+            stats['workers'] = sorted(self._worker_pids)
+        return stats
+
+    def handle_control_command(self, command):
+        """
+        Answer a command of the control socket, override it to add commands
+
+        Args:
+            command (str):
+
+        Returns:
+            JSON serializable response
+        """
+        if command == 'stats':
+            return self.get_stats()
+        return dict(error = "Unknown command '%s'" % command)
+
+    def start_control_server(self):
+        """Listen on the control_socket in a background thread, called by the start() after the daemonize"""
+        if os.path.exists(self.control_socket):
+            os.remove(self.control_socket)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.control_socket)
+        # the daemonize sets umask 0, only the owner may query the daemon
+        os.chmod(self.control_socket, 0o600)
+        server.listen(8)
+        thread = Thread(target = self._serve_control, args = (server, ), name = 'daemon-control')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    control_timeout = 2
+
+    def _serve_control(self, server):
+        while True:
+            connection = server.accept()[0]
+            # an idle client must not block the other queries
+            connection.settimeout(self.control_timeout)
+            try:
+                with connection.makefile('r') as reader:
+                    command = reader.readline().strip()
+                response = self.handle_control_command(command)
+                connection.sendall((json.dumps(response) + '\n').encode('utf-8'))
+            except Exception:
+                self.logger.exception("Error occured during handling a control command")
+            finally:
+                connection.close()
+
+    def query_control(self, command = 'stats', timeout = 2):
+        """Send a command to the control socket of the running daemon and return its response"""
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(timeout)
+        try:
+            client.connect(self.control_socket)
+            client.sendall((command + '\n').encode('utf-8'))
+            with client.makefile('r') as reader:
+                return json.loads(reader.readline())
+        finally:
+            client.close()
 
     def start(self):
         """
         Start the daemon
         """
 
-        if self.is_running():
+        if self.is_running() and self.get_pid() != self._handoff_pid:
             msg = "Daemon already running (pidfile:%s)" % self.pidfile
             self.logger.error(msg)
             return msg
@@ -113,6 +348,14 @@ class Daemon(object):
 
         # Start the daemon
         self.daemonize()
+        self._started = time.time()
+        if self.control_socket:
+            self.start_control_server()
+        signal.signal(SIGUSR2, self._handle_handoff)
+        if self.workers:
+            return self.run_workers()
+        signal.signal(SIGTERM, self._handle_term)
+        signal.signal(SIGHUP, self._handle_hup)
         return self.run()
 
     def stop(self):
@@ -129,29 +372,329 @@ class Daemon(object):
 
         # Try killing the daemon process
         try:
-            while 1:
-                os.kill(pid, SIGTERM)
-                time.sleep(0.1)
+            os.kill(pid, SIGTERM)
+        except ProcessLookupError:
+            pass
         except OSError as err:
-            err = str(err)
-            if err.find("No such process") > 0:
-                if os.path.exists(self.pidfile):
-                    os.remove(self.pidfile)
-            else:
-                self.logger.error(err)
-                sys.exit(1)
+            self.logger.error(str(err))
+            sys.exit(1)
+
+        # the daemon kills itself after the stop_timeout too, but it may hang in a signal handler
+        if not wait_for_pid(pid, None if self.stop_timeout is None else self.stop_timeout + 1):
+            self.logger.error("Daemon (pid %s) did not stop in %s sec, kill it", pid, self.stop_timeout)
+            try:
+                os.kill(pid, SIGKILL)
+            except ProcessLookupError:
+                pass
+            wait_for_pid(pid)
+
+        if os.path.exists(self.pidfile):
+            os.remove(self.pidfile)
 
         return 'Daemon is stopped'
 
-    def restart(self):
+    def request_reload(self):
+        """
+        Send a SIGHUP to the running daemon to call its reload()
+        """
+        pid = self.get_pid()
+
+        if not pid or not self.is_running():
+            message = "Daemon is not running (pidfile:%s)" % self.pidfile
+            self.logger.error(message)
+            return message
+
+        os.kill(pid, SIGHUP)
+        return 'Daemon is reloading'
+
+    def restart(self, graceful = False):
         """
         Restart the daemon
+
+        Args:
+            graceful (bool): the running daemon starts its replacement, passes the listening sockets to it and drains,
+                             so the connections are not refused during the restart
+        """
+        if self._handoff_pid:
+            # started by the get_restart_command() of a graceful restart
+            return self.start()
+
+        pid = self.get_pid()
+        if not graceful or not pid or not self.is_running():
+            self.stop()
+            self.start()
+            return
+
+        os.kill(pid, SIGUSR2)
+        if not wait_for_pid(pid, None if self.stop_timeout is None else self.stop_timeout * 2 + 1):
+            message = "The old daemon (pid %s) is still running" % pid
+            self.logger.error(message)
+            return message
+        return 'Daemon is restarted'
+
+    def listen(self, address, name = None, family = socket.AF_INET, type = socket.SOCK_STREAM, backlog = 128):
+        """
+        Create a listening socket or take over it from the replaced daemon at a graceful restart. Call it in the
+        init() (before the fork of the workers in the pre-fork mode).
+
+        Args:
+            address: the address to bind, eg ('0.0.0.0', 8080) or a path for the AF_UNIX
+            name (str): identifies the socket between the old and the new daemon, default is the str of the address
+            family (int):
+            type (int):
+            backlog (int):
+
+        Returns:
+            socket.socket: the listening socket, also stored in the sockets dict
         """
-        self.stop()
-        self.start()
+        name = name or str(address)
+        if name in self._inherited_fds:
+            fd = self._inherited_fds.pop(name)
+            sock = socket.fromfd(fd, family, type)
+            os.close(fd)
+            self.logger.info("Listening socket '%s' is taken over from the pid %s", name, self._handoff_pid)
+        else:
+            sock = socket.socket(family, type)
+            if family != socket.AF_UNIX:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(address)
+            sock.listen(backlog)
+        self.sockets[name] = sock
+        return sock
+
+    def get_restart_command(self):
+        """
+        Returns:
+            list: the command line of the replacement at the graceful restart, which must call the start() or the
+                  restart() of the daemon. Default is the command line of the current process.
+        """
+        return [sys.executable] + sys.argv
+
+    def spawn_replacement(self):
+        """
+        Start the replacement daemon with the listening sockets and wait for its pid in the pidfile
+
+        Returns:
+            bool: True if the replacement is running
+        """
+        fds = {name: sock.fileno() for name, sock in self.sockets.items()}
+        env = dict(os.environ)
+        env[HANDOFF_FDS_ENV] = json.dumps(fds)
+        env[HANDOFF_PID_ENV] = str(os.getpid())
+        try:
+            # the first parent of the daemonize exits right after the fork
+            subprocess.Popen(self.get_restart_command(), cwd = self._start_cwd, env = env,
+                             pass_fds = list(fds.values())).wait()
+        except OSError:
+            self.logger.exception("Cannot start the replacement daemon")
+            return False
+
+        deadline = time.monotonic() + (self.stop_timeout or 10)
+        while time.monotonic() < deadline:
+            pid = self.get_pid()
+            if pid is not None and pid != os.getpid():
+                self.logger.info("Replaced by the pid %s", pid)
+                return True
+            time.sleep(0.01)
+
+        self.logger.error("The replacement daemon did not start in time, keep running")
+        return False
 
     def run(self):
         """
         You should override this method when you subclass Daemon. It will be called after the process has been
         daemonized by start() or restart().
         """
+
+    def shutdown(self):
+        """
+        Called at SIGTERM (in the signal handler, so in the main thread), exits immediately by default. Override it to
+        start a graceful drain, eg close the listening sockets, and return from the run() when should_exit() is True.
+        """
+        sys.exit(0)
+
+    def reload(self):
+        """
+        Called at SIGHUP (in the signal handler, so in the main thread), override it to reload the config without the
+        restart of the process, eg call the ConfigLoader.load again.
+        """
+
+    def worker_run(self):
+        """
+        Override this method to use the pre-fork mode, it will be called in every worker process. Return from it to
+        exit the worker (it will be respawned), raise an exception to report a crash.
+        """
+
+    def job_done(self):
+        """Call it in the worker_run() after every job, to count the jobs for the recycling"""
+        self.jobs_done += 1
+
+    def should_exit(self):
+        """
+        Returns:
+            bool: True if the worker should return from the worker_run(): it is stopping or reached a recycle limit
+        """
+        if self._exiting:
+            return True
+        if self.max_jobs is not None and self.jobs_done >= self.max_jobs:
+            return True
+        if self.max_rss is not None and self.jobs_done:
+            rss = get_rss()
+            if rss is not None and rss > self.max_rss:
+                return True
+        return False
+
+    # the workers exited earlier are respawned with backoff like the crashed ones
+    min_worker_lifetime = 1
+
+    def _spawn_worker(self, worker_id):
+        pid = os.fork()
+        if pid > 0:
+            return pid
+
+        # in the worker
+        signal.signal(SIGTERM, self._handle_term)
+        signal.signal(SIGHUP, self._handle_hup)
+        signal.signal(SIGUSR2, signal.SIG_DFL)
+        self.worker_id = worker_id
+        self.jobs_done = 0
+        self._worker_pids = {}
+        exit_code = 0
+        try:
+            self.worker_run()
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            self.logger.exception("Worker %s crashed", worker_id)
+            exit_code = 1
+        finally:
+            # the atexit handlers are skipped (they belong to the master), but the delayed jobs (eg the cache writes)
+            # and the buffered output of the worker must not be lost
+            try:
+                _drain_pending_delayers()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except BaseException:
+                self.logger.exception("Worker %s cannot finish the pending jobs", worker_id)
+            os._exit(exit_code)
+
+    def _handle_term(self, signum, frame):
+        if self._exiting:
+            return
+        self._exiting = True
+        # the workers are killed by the master
+        if self.worker_id is None and self.stop_timeout is not None:
+            watchdog = Timer(self.stop_timeout, os.kill, (os.getpid(), SIGKILL))
+            watchdog.daemon = True
+            watchdog.start()
+        self.shutdown()
+
+    def _handle_handoff(self, signum, frame):
+        if self._exiting or not self.spawn_replacement():
+            return
+        if self.workers:
+            self._handle_master_term(signum, frame)
+        else:
+            self._handle_term(signum, frame)
+
+    def _handle_hup(self, signum, frame):
+        try:
+            self.reload()
+        except Exception:
+            self.logger.exception("Reload failed")
+
+    def _signal_workers(self, signum):
+        for pid in list(self._worker_pids):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def _handle_master_term(self, signum, frame):
+        if self._exiting:
+            return
+        self._exiting = True
+        if self.stop_timeout is not None:
+            watchdog = Timer(self.stop_timeout, self._kill_workers)
+            watchdog.daemon = True
+            watchdog.start()
+        self._signal_workers(SIGTERM)
+
+    def _kill_workers(self):
+        if self._worker_pids:
+            self.logger.error("%s worker(s) did not stop in %s sec, kill them", len(self._worker_pids),
+                              self.stop_timeout)
+            self._signal_workers(SIGKILL)
+
+    def _handle_master_hup(self, signum, frame):
+        self._handle_hup(signum, frame)
+        self._signal_workers(SIGHUP)
+
+    def run_workers(self):
+        """
+        The master loop of the pre-fork mode: forks the workers, respawns them and stops them at SIGTERM (kills them
+        after the stop_timeout). Called by the start() after the daemonize if the workers > 0.
+        """
+        # pid -> (worker id, start time)
+        self._worker_pids = {}
+        # worker id -> respawn time
+        respawns = {}
+        # worker id -> current backoff
+        backoffs = {}
+        self._exiting = False
+        previous_handlers = signal.signal(SIGTERM, self._handle_master_term), signal.signal(SIGHUP,
+                                                                                            self._handle_master_hup)
+
+        try:
+            for worker_id in range(self.workers):
+                self._worker_pids[self._spawn_worker(worker_id)] = (worker_id, time.monotonic())
+
+            while self._worker_pids or (respawns and not self._exiting):
+                now = time.monotonic()
+                for worker_id, respawn_time in list(respawns.items()):
+                    if respawn_time <= now and not self._exiting:
+                        del respawns[worker_id]
+                        self._worker_pids[self._spawn_worker(worker_id)] = (worker_id, now)
+
+                # poll while a respawn is pending, block otherwise
+                polling = bool(respawns) and not self._exiting
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG if polling else 0)
+                except ChildProcessError:
+                    if not polling:
+                        break
+                    pid = 0
+                if not pid:
+                    time.sleep(max(0, min(0.1, min(respawns.values()) - now)))
+                    continue
+
+                if pid not in self._worker_pids:
+                    continue
+                worker_id, started = self._worker_pids.pop(pid)
+                if self._exiting:
+                    continue
+
+                now = time.monotonic()
+                clean = os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+                if clean and now - started >= self.min_worker_lifetime:
+                    self.logger.info("Worker %s (pid %s) exited, respawn", worker_id, pid)
+                    backoffs.pop(worker_id, None)
+                    respawns[worker_id] = now
+                    continue
+
+                # crashed or exited too early (eg the worker_run is not overridden), do not fork in a tight loop
+                backoff = backoffs.get(worker_id, 0)
+                if now - started > self.max_respawn_backoff:
+                    backoff = 0
+                backoff = min(backoff * 2 or self.respawn_backoff, self.max_respawn_backoff)
+                backoffs[worker_id] = backoff
+                if clean:
+                    self.logger.warning("Worker %s (pid %s) exited after %.3f sec, respawn in %s sec", worker_id, pid,
+                                        now - started, backoff)
+                else:
+                    self.logger.error("Worker %s (pid %s) crashed (status %s), respawn in %s sec", worker_id, pid,
+                                      status, backoff)
+                respawns[worker_id] = now + backoff
+        finally:
+            signal.signal(SIGTERM, previous_handlers[0])
+            signal.signal(SIGHUP, previous_handlers[1])
@@ -1,10 +1,13 @@
-import collections
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
 
 def recursive_update(target, source):
     for key, val in source.items():
-        if isinstance(val, collections.Mapping) and key in target and isinstance(target[key], collections.Mapping):
+        if isinstance(val, Mapping) and key in target and isinstance(target[key], Mapping):
             target[key] = recursive_update(target[key], val)
-        elif isinstance(val, collections.Sequence) and key in target and isinstance(target[key], collections.Sequence):
+        elif isinstance(val, Sequence) and key in target and isinstance(target[key], Sequence):
             target[key] += source[key]
         else:
             target[key] = source[key]
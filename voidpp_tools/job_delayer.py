@@ -1,32 +1,445 @@
+import os
+import time
+import atexit
+import asyncio
+import logging
+from threading import Condition, Lock
+from .timer import DeadlineScheduler, get_scheduler, call_in_loop
 
-from threading import Timer
+logger = logging.getLogger(__name__)
+
+# the delayers with a pending job, to run them at the interpreter exit
+_pending_delayers = set()
+_pending_lock = Lock()
+_pending_pid = os.getpid()
+
+def _forget_pending_delayers():
+    """In a forked child: the pending jobs belong to the parent, the child must not run them (the scheduler drops
+    their calls too), only the ones started in the child"""
+    global _pending_lock, _pending_pid
+    _pending_lock = Lock()
+    _pending_pid = os.getpid()
+    for delayer in list(_pending_delayers):
+        delayer._after_fork()
+    _pending_delayers.clear()
+
+# the pid check of the drain covers the older pythons
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child = _forget_pending_delayers)
+
+@atexit.register
+def _drain_pending_delayers():
+    if _pending_pid != os.getpid():
+        _forget_pending_delayers()
+    with _pending_lock:
+        delayers = list(_pending_delayers)
+    for delayer in delayers:
+        try:
+            delayer.flush_now()
+        except Exception:
+            logger.exception("Error occured during draining the delayed job %s", delayer)
+
+class BatchQueueFullException(Exception):
+    pass
 
 class JobDelayer(object):
     """It will delaying the given job with the given timeout and if a delaying is already in progress reset the timeout
 
+    The delayers do not create threads, they share the thread of a DeadlineScheduler and the job runs in its thread
+    pool. The pending jobs are run at the interpreter exit.
+
     Args:
         job (callable): callback
         timeout (float): timeout in seconds
+        max_delay (float): the job runs at most max_delay seconds after the first start of the pending period, even if
+                           the start is called continuously
+        scheduler (DeadlineScheduler): default is the process-wide one (see timer.get_default_scheduler)
     """
 
-    def __init__(self, job: callable, timeout: float = 1):
+    def __init__(self, job: callable, timeout: float = 1, max_delay: float = None,
+                 scheduler: DeadlineScheduler = None):
         self._timeout = timeout
+        self._max_delay = max_delay
         self._job = job
-        self._timer = None
+        self._scheduler = scheduler
+        self._call = None
+        self._deadline = None
+        self._first_start = None
+        self._lock = Lock()
 
     @property
     def timeout(self):
         return self._timeout
 
+    @property
+    def max_delay(self):
+        return self._max_delay
+
+    @property
+    def pending(self):
+        return self._deadline is not None
+
+    def _clear(self):
+        self._deadline = None
+        self._first_start = None
+        with _pending_lock:
+            _pending_delayers.discard(self)
+
+    def _after_fork(self):
+        self._lock = Lock()
+        self._deadline = None
+        self._first_start = None
+
     def _fire(self):
-        self._timer = None
+        with self._lock:
+            # cancelled or restarted after the scheduler already picked up the call
+            if self._deadline is None or time.monotonic() < self._deadline:
+                return
+            self._clear()
         self._job()
 
     def start(self):
         """Starts the delayed execution"""
 
-        if self._timer:
-            self._timer.cancel()
+        with self._lock:
+            now = time.monotonic()
+            if self._deadline is None:
+                self._first_start = now
+                with _pending_lock:
+                    _pending_delayers.add(self)
+
+            self._deadline = now + self._timeout
+            if self._max_delay is not None:
+                self._deadline = min(self._deadline, self._first_start + self._max_delay)
+
+            if self._call is None:
+                self._call = get_scheduler(self._scheduler).create(self._fire)
+            self._call.schedule(self._deadline)
+
+    def cancel(self):
+        """Cancel the pending execution
+
+        Returns:
+            bool: True if there was a pending execution
+        """
+        with self._lock:
+            if self._deadline is None:
+                return False
+            self._call.cancel()
+            self._clear()
+            return True
+
+    def flush_now(self):
+        """Run the pending job immediately in the caller thread
+
+        Returns:
+            bool: True if there was a pending execution
+        """
+        if not self.cancel():
+            return False
+        self._job()
+        return True
+
+
+class Throttle(object):
+    """Run the job at most once per interval, even in a continuous burst of calls (unlike the JobDelayer)
+
+    The first call of a quiet period runs the job immediately (leading edge), the calls during the interval run the
+    job once at the end of it (trailing edge). The job runs in the thread pool of the scheduler, and the interval is
+    timed from the start of the run, so a busy pool cannot bring two runs closer. A pending trailing job is run at the
+    interpreter exit.
+
+    Args:
+        job (callable): callback
+        interval (float): seconds
+        leading (bool): run the job at the first call
+        trailing (bool): run the job at the end of the interval if there was a call after the leading one
+        scheduler (DeadlineScheduler): default is the process-wide one (see timer.get_default_scheduler)
+    """
+
+    def __init__(self, job: callable, interval: float = 1, leading = True, trailing = True,
+                 scheduler: DeadlineScheduler = None):
+        if not leading and not trailing:
+            raise ValueError("At least one of the leading and trailing must be set")
+        self._job = job
+        self._interval = interval
+        self._leading = leading
+        self._trailing = trailing
+        self._scheduler = scheduler
+        self._call = None
+        self._window_end = None
+        self._trailing_pending = False
+        self._lock = Lock()
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def pending(self):
+        return self._trailing_pending
+
+    def _open_window(self, start: float):
+        self._window_end = start + self._interval
+        if self._call is None:
+            self._call = get_scheduler(self._scheduler).create(self._close_window)
+        self._call.schedule(self._window_end)
+
+    def _after_fork(self):
+        self._lock = Lock()
+        self._window_end = None
+        self._trailing_pending = False
+
+    def _set_trailing(self, pending: bool):
+        self._trailing_pending = pending
+        with _pending_lock:
+            if pending:
+                _pending_delayers.add(self)
+            else:
+                _pending_delayers.discard(self)
+
+    def _close_window(self):
+        with self._lock:
+            if self._window_end is None or time.monotonic() < self._window_end:
+                return
+            if not self._trailing_pending:
+                self._window_end = None
+                return
+            self._set_trailing(False)
+        self._run()
+
+    def _run(self):
+        with self._lock:
+            # every run starts a new interval
+            self._open_window(time.monotonic())
+        try:
+            self._job()
+        except:
+            # nobody reads the future of the leading run
+            logger.exception("Error occured during throttled job run")
+
+    def __call__(self):
+        """Request a run of the job"""
+        with self._lock:
+            if self._window_end is not None:
+                if self._trailing:
+                    self._set_trailing(True)
+                return
+            if not self._leading:
+                self._open_window(time.monotonic())
+                self._set_trailing(True)
+                return
+            # the window is open until the leading run starts its interval in the pool
+            self._window_end = float('inf')
+        get_scheduler(self._scheduler).submit(self._run)
+
+    def cancel(self):
+        """Drop the pending trailing run
+
+        Returns:
+            bool: True if there was a pending run
+        """
+        with self._lock:
+            pending = self._trailing_pending
+            self._set_trailing(False)
+            return pending
+
+    def flush_now(self):
+        """Run the pending trailing job immediately in the caller thread
+
+        Returns:
+            bool: True if there was a pending run
+        """
+        if not self.cancel():
+            return False
+        self._job()
+        return True
+
+
+class BatchJobDelayer(object):
+    """Collects the submitted items and calls the job with them in one list (eg bulk DB writes or HTTP calls)
+
+    The job is called when the batch reaches the max_size or max_delay seconds after the first item of the batch,
+    whichever comes first. The full batches run in the thread pool of the scheduler, the timed out ones in the
+    scheduler thread pool too. The pending items are passed to the job at the interpreter exit.
+
+    Args:
+        job (callable): called with the list of the items
+        max_size (int): max number of the items in a batch
+        max_delay (float): seconds
+        max_pending (int): max number of the items waiting for the job (incl. the running batches), the submit blocks
+                           or raises BatchQueueFullException above it, None for unlimited
+        scheduler (DeadlineScheduler): default is the process-wide one (see timer.get_default_scheduler)
+    """
+
+    def __init__(self, job: callable, max_size: int = 100, max_delay: float = 1, max_pending: int = None,
+                 scheduler: DeadlineScheduler = None):
+        self._job = job
+        self._max_size = max_size
+        self._max_delay = max_delay
+        self._max_pending = max_pending
+        self._scheduler = scheduler
+        self._call = None
+        self._batch = []
+        self._in_flight = 0
+        self._condition = Condition(Lock())
+
+    @property
+    def pending(self):
+        """Number of the submitted items not yet processed by the job"""
+        return len(self._batch) + self._in_flight
+
+    def _after_fork(self):
+        # the parent processes its items
+        self._condition = Condition(Lock())
+        self._batch = []
+        self._in_flight = 0
+
+    def _take_batch(self):
+        batch = self._batch
+        self._batch = []
+        self._in_flight += len(batch)
+        if self._call is not None:
+            self._call.cancel()
+        with _pending_lock:
+            _pending_delayers.discard(self)
+        return batch
+
+    def _run_batch(self, batch: list):
+        try:
+            self._job(batch)
+        except Exception:
+            logger.exception("Error occured during processing a batch of %s items", len(batch))
+        finally:
+            with self._condition:
+                self._in_flight -= len(batch)
+                self._condition.notify_all()
+
+    def _fire(self):
+        with self._condition:
+            if not self._batch:
+                return
+            batch = self._take_batch()
+        self._run_batch(batch)
+
+    def submit(self, item, block = True, timeout: float = None):
+        """Add an item to the current batch
+
+        Args:
+            item: any object
+            block (bool): wait for free space if there are max_pending items
+            timeout (float): max seconds to wait for free space, None for forever
+
+        Raises:
+            BatchQueueFullException: if there is no free space (in time)
+        """
+        with self._condition:
+            if self._max_pending is not None and self.pending >= self._max_pending:
+                if not block or not self._condition.wait_for(lambda: self.pending < self._max_pending, timeout):
+                    raise BatchQueueFullException("There are {} pending items".format(self.pending))
+
+            self._batch.append(item)
+            if len(self._batch) < self._max_size:
+                if len(self._batch) == 1:
+                    with _pending_lock:
+                        _pending_delayers.add(self)
+                    if self._call is None:
+                        self._call = get_scheduler(self._scheduler).create(self._fire)
+                    self._call.schedule_later(self._max_delay)
+                return
+            batch = self._take_batch()
+
+        # outside of the lock, the shut down pool runs the batch in this thread
+        get_scheduler(self._scheduler).submit(self._run_batch, batch)
+
+    def flush_now(self):
+        """Call the job with the current batch immediately in the caller thread
+
+        Returns:
+            bool: True if there was a pending item
+        """
+        with self._condition:
+            if not self._batch:
+                return False
+            batch = self._take_batch()
+        self._run_batch(batch)
+        return True
+
+
+class AsyncJobDelayer(object):
+    """The JobDelayer for asyncio, based on loop.call_at without any thread
+
+    The job can be a sync function (called in the loop) or a coroutine function (started as a task). The methods
+    must be called from the event loop thread. The pending jobs are not run at the interpreter exit, call flush_now
+    at the shutdown.
+
+    Args:
+        job (callable): sync or coroutine function
+        timeout (float): timeout in seconds
+        max_delay (float): see JobDelayer
+        loop (asyncio.AbstractEventLoop): default is the event loop of the start() caller
+    """
+
+    def __init__(self, job: callable, timeout: float = 1, max_delay: float = None, loop = None):
+        self._timeout = timeout
+        self._max_delay = max_delay
+        self._job = job
+        self._loop = loop
+        self._handle = None
+        self._first_start = None
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def max_delay(self):
+        return self._max_delay
+
+    @property
+    def pending(self):
+        return self._handle is not None
+
+    def _fire(self):
+        self._handle = None
+        self._first_start = None
+        call_in_loop(self._loop, self._job)
+
+    def start(self):
+        """Starts the delayed execution"""
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+
+        now = self._loop.time()
+        if self._handle is None:
+            self._first_start = now
+        else:
+            self._handle.cancel()
+
+        deadline = now + self._timeout
+        if self._max_delay is not None:
+            deadline = min(deadline, self._first_start + self._max_delay)
+
+        self._handle = self._loop.call_at(deadline, self._fire)
+
+    def cancel(self):
+        """
+        Returns:
+            bool: True if there was a pending execution
+        """
+        if self._handle is None:
+            return False
+        self._handle.cancel()
+        self._handle = None
+        self._first_start = None
+        return True
+
+    def flush_now(self):
+        """Run the pending job immediately
 
-        self._timer = Timer(self._timeout, self._fire)
-        self._timer.start()
+        Returns:
+            the asyncio.Task of a coroutine job, True for a sync job or False if there was no pending execution
+        """
+        if not self.cancel():
+            return False
+        return call_in_loop(self._loop, self._job) or True
@@ -1,11 +1,142 @@
+import time
+import atexit
+from threading import Lock, Thread
+
+from .compat import UnsupportedOperation
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
 
 class LoggerProxy(object):
-    def __init__(self, level):
+    """Text stream writes the complete lines to a logger function, eg sys.stdout = LoggerProxy(logger.info)
+
+    The partial lines are buffered until the newline, so a print(a, b) is one record. The empty lines are skipped.
+
+    Args:
+        level (callable): logger function, eg logger.info
+        max_buffer (int): emit the partial line when it is longer than this (chars)
+        flush_interval (float): emit the partial line this many seconds after its first write (at the next write, or
+                                in the background thread), None to wait for the newline or the flush
+        background (bool): call the logger function in a background thread, so the writes never block on the handlers
+        fd (int): the file descriptor returned by the fileno(), None to raise UnsupportedOperation
+    """
+
+    encoding = 'utf-8'
+    errors = 'strict'
+
+    def __init__(self, level, max_buffer = 8192, flush_interval = 1, background = False, fd = None):
         self.level = level
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self._fd = fd
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_started = None
+        self._lock = Lock()
+        self._queue = None
+        self._thread = None
+        self.closed = False
+
+        if background:
+            self._queue = Queue()
+            self._thread = Thread(target = self._process_queue, name = 'logger-proxy')
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _emit(self, lines):
+        lines = [line for line in lines if line]
+        if not lines:
+            return
+        if self._queue is not None:
+            self._queue.put(lines)
+            return
+        for line in lines:
+            self.level(line)
+
+    def _take_buffer(self):
+        partial = ''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_started = None
+        return partial
+
+    def _is_stale(self):
+        return self._buffer_started is not None and self.flush_interval is not None and \
+            time.monotonic() - self._buffer_started >= self.flush_interval
 
     def write(self, msg):
-        if msg != '\n':
-            self.level(msg)
+        with self._lock:
+            lines = msg.split('\n')
+            if len(lines) > 1:
+                lines[0] = self._take_buffer() + lines[0]
+                complete, partial = lines[:-1], lines[-1]
+            else:
+                complete, partial = [], msg
+
+            if partial:
+                if self._buffer_started is None:
+                    self._buffer_started = time.monotonic()
+                self._buffer.append(partial)
+                self._buffer_size += len(partial)
+                if self._buffer_size > self.max_buffer or self._is_stale():
+                    complete.append(self._take_buffer())
+
+        self._emit(complete)
+        return len(msg)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
 
     def flush(self):
-        pass
+        """Emit the partial line"""
+        with self._lock:
+            partial = self._take_buffer()
+        self._emit([partial])
+
+    def _process_queue(self):
+        while True:
+            try:
+                lines = self._queue.get(timeout = self.flush_interval)
+            except Empty:
+                with self._lock:
+                    partial = self._take_buffer() if self._is_stale() else ''
+                lines = [partial] if partial else []
+            if lines is None:
+                return
+            for line in lines:
+                try:
+                    self.level(line)
+                except Exception:
+                    # the thread must survive a broken logger function
+                    pass
+
+    def close(self):
+        """Emit the partial line and wait for the background thread to finish the logging"""
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        if self._fd is None:
+            raise UnsupportedOperation("LoggerProxy has no file descriptor")
+        return self._fd
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
@@ -0,0 +1,317 @@
+import sqlite3
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
+
+from voidpp_tools.cache import FileCacheHub
+from voidpp_tools.cache_serializers import CacheSerializer, JSONSerializer, dumps, loads, readable_formats
+
+logger = logging.getLogger(__name__)
+
+class SQLiteLazyMapping(MutableMapping):
+    """Dict node of a split_mappings SQLiteStorage, the keys are read from the database by point queries at their first
+    use, and all of them only when the node is iterated (in the stored order)
+
+    Args:
+        storage (SQLiteStorage):
+        node (str): name of the node
+    """
+
+    def __init__(self, storage, node: str):
+        self._storage = storage
+        self._node = node
+        self._items = {}
+        # the keys deleted since the load, the rows are removed at the next write
+        self._deleted = set()
+        self._fully_loaded = False
+
+    def _load_all(self):
+        if self._fully_loaded:
+            return
+        items = OrderedDict()
+        for key, value in self._storage.load_keys(self._node):
+            if key not in self._deleted:
+                items[key] = value
+        # the new keys go to the end, like in a dict
+        for key, value in self._items.items():
+            items[key] = value
+        self._items = items
+        self._fully_loaded = True
+
+    def loaded_keys(self):
+        """The keys differ from the stored rows only in the loaded and the deleted keys
+
+        Returns:
+            tuple: (loaded keys, deleted keys), or None if all the keys are loaded
+        """
+        if self._fully_loaded:
+            return None
+        return list(self._items), set(self._deleted)
+
+    def __getitem__(self, key):
+        if key in self._items:
+            return self._items[key]
+        if self._fully_loaded or key in self._deleted or not isinstance(key, str):
+            raise KeyError(key)
+        found, value = self._storage.load_key(self._node, key)
+        if not found:
+            raise KeyError(key)
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        del self._items[key]
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        self._load_all()
+        return iter(list(self._items))
+
+    def __len__(self):
+        self._load_all()
+        return len(self._items)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self.items()))
+
+
+class SQLiteStorage(object):
+    """Keeps the top level nodes in the rows of an SQLite database (in WAL mode)
+
+    The changed nodes of a write are updated in one transaction, the nodes can be loaded one by one (see the lazy
+    mode of the FileCacheHub). With split_mappings the dict nodes are stored in one row per key, the changes of
+    'node.key' paths update only the row of the key, and the lazy loaded dict nodes are SQLiteLazyMapping instances,
+    which read the rows of the used keys only.
+
+    Args:
+        db_path (str):
+        split_mappings (bool): store the keys of the dict nodes in separate rows
+        serializer (CacheSerializer): format of the row data, JSON by default
+        allowed_formats (iterable): see FileStorage
+    """
+
+    schema = "CREATE TABLE IF NOT EXISTS cache_nodes (node TEXT NOT NULL, key TEXT NOT NULL, data BLOB, " \
+             "PRIMARY KEY (node, key))"
+
+    # key of the rows hold a whole node, the keys of the split dicts are prefixed with a dot
+    node_key = ''
+    bytes_written = 0
+
+    def __init__(self, db_path: str, split_mappings = False, serializer: CacheSerializer = None,
+                 allowed_formats = None):
+        self.db_path = db_path
+        self._split_mappings = split_mappings
+        self._serializer = serializer or JSONSerializer()
+        self._allowed_formats = readable_formats(self._serializer, allowed_formats)
+        self._lock = Lock()
+        # the hub writes from the thread of the JobDelayer
+        self._connection = sqlite3.connect(db_path, check_same_thread = False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(self.schema)
+        self._connection.commit()
+
+    def _decode_node(self, rows):
+        if len(rows) == 1 and rows[0][0] == self.node_key:
+            return loads(rows[0][1], self._allowed_formats)
+        return OrderedDict((key[1:], loads(data, self._allowed_formats)) for key, data in rows if key != self.node_key)
+
+    def load(self):
+        with self._lock:
+            # the rowid keeps the order of the keys (eg the recency order of an LRUCacheNode)
+            rows = self._connection.execute('SELECT node, key, data FROM cache_nodes ORDER BY node, rowid').fetchall()
+        if not rows:
+            return None
+        nodes = OrderedDict()
+        for node, key, data in rows:
+            nodes.setdefault(node, []).append((key, data))
+        return {node: self._decode_node(node_rows) for node, node_rows in nodes.items()}
+
+    def load_lazy(self):
+        with self._lock:
+            names = [row[0] for row in self._connection.execute('SELECT DISTINCT node FROM cache_nodes')]
+        return ({} if names else None), names
+
+    def load_node(self, name: str):
+        logger.debug("Load node '%s' from '%s'", name, self.db_path)
+        with self._lock:
+            if self._split_mappings:
+                row = self._connection.execute('SELECT data FROM cache_nodes WHERE node = ? AND key = ?',
+                                               (name, self.node_key)).fetchone()
+                if row is None:
+                    return SQLiteLazyMapping(self, name)
+                return loads(row[0], self._allowed_formats)
+            rows = self._connection.execute('SELECT key, data FROM cache_nodes WHERE node = ? ORDER BY rowid',
+                                            (name, )).fetchall()
+        return self._decode_node(rows)
+
+    def load_key(self, name: str, key: str):
+        """Read one key of a split dict node
+
+        Returns:
+            tuple: (found, value)
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT data FROM cache_nodes WHERE node = ? AND key = ?',
+                                           (name, '.' + key)).fetchone()
+        return (False, None) if row is None else (True, loads(row[0], self._allowed_formats))
+
+    def load_keys(self, name: str):
+        """Read all keys of a split dict node in the stored order
+
+        Returns:
+            list: (key, value) tuples
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT key, data FROM cache_nodes WHERE node = ? AND key != ? '
+                                            'ORDER BY rowid', (name, self.node_key)).fetchall()
+        return [(key[1:], loads(data, self._allowed_formats)) for key, data in rows]
+
+    def _node_rows(self, name, value):
+        # an empty dict has no keys, it is stored as a whole node to survive the reload, like the dicts with not str
+        # keys (eg with pickle serializer)
+        if self._split_mappings and isinstance(value, Mapping) and len(value) and \
+                all(isinstance(key, str) for key in value):
+            return [(name, '.' + key, self._encode(item)) for key, item in value.items()]
+        if isinstance(value, SQLiteLazyMapping):
+            value = OrderedDict(value.items())
+        return [(name, self.node_key, self._encode(value))]
+
+    def _encode(self, value):
+        content = dumps(self._serializer, value)
+        if isinstance(content, bytes):
+            return sqlite3.Binary(content), len(content)
+        return content, len(content.encode('utf-8'))
+
+    def write(self, data, changes: OrderedDict):
+        if not isinstance(data, dict):
+            raise TypeError("The root data of an SQLite cache must be a dict, got {}".format(type(data).__name__))
+
+        nodes = set()
+        keys = set()
+        for path in changes:
+            parts = path.split('.')
+            if not path:
+                nodes = None
+                break
+            if self._split_mappings and len(parts) > 1 and isinstance(data.get(parts[0]), Mapping):
+                keys.add((parts[0], parts[1]))
+            else:
+                nodes.add(parts[0])
+
+        logger.debug("Write %s node(s) and %s key(s) to '%s'", 'all' if nodes is None else len(nodes), len(keys),
+                     self.db_path)
+
+        root = nodes is None
+        if root:
+            nodes, keys = set(data), set()
+
+        for name in list(nodes) if not root else []:
+            loaded = data[name].loaded_keys() if isinstance(data.get(name), SQLiteLazyMapping) else None
+            if loaded is not None and all(isinstance(key, str) for key in loaded[0]):
+                # the unused keys of a lazy node are unchanged, the write must not read them all
+                nodes.discard(name)
+                keys.update((name, key) for key in loaded[0] + list(loaded[1]))
+
+        # encode before the lock, a SQLiteLazyMapping reads its missing keys through the storage
+        node_rows = {name: self._node_rows(name, data[name]) if name in data else [] for name in nodes}
+        key_rows = {(name, key): self._encode(data[name][key]) if key in data[name] else None
+                    for name, key in keys if name not in nodes}
+
+        with self._lock, self._connection:
+            if root:
+                self._connection.execute('DELETE FROM cache_nodes')
+
+            for name, rows in node_rows.items():
+                self._connection.execute('DELETE FROM cache_nodes WHERE node = ?', (name, ))
+                self._connection.executemany('INSERT INTO cache_nodes VALUES (?, ?, ?)',
+                                             [(node, key, content) for node, key, (content, size) in rows])
+                self.bytes_written += sum(size for node, key, (content, size) in rows)
+
+            emptied = set()
+            rewritten = set()
+            for (name, key), encoded in key_rows.items():
+                if name in rewritten:
+                    continue
+                if encoded is None:
+                    self._connection.execute('DELETE FROM cache_nodes WHERE node = ? AND key = ?', (name, '.' + key))
+                    emptied.add(name)
+                    continue
+                whole = self._connection.execute('DELETE FROM cache_nodes WHERE node = ? AND key = ?',
+                                                 (name, self.node_key)).rowcount
+                if whole and not isinstance(data[name], SQLiteLazyMapping):
+                    # stored as a whole node (eg it had not str keys), the other keys have no rows (a lazy mapping
+                    # is stored as a whole only if it was empty)
+                    self._connection.execute('DELETE FROM cache_nodes WHERE node = ?', (name, ))
+                    rows = self._node_rows(name, data[name])
+                    self._connection.executemany('INSERT INTO cache_nodes VALUES (?, ?, ?)',
+                                                 [(node, row_key, content) for node, row_key, (content, size) in rows])
+                    self.bytes_written += sum(size for node, row_key, (content, size) in rows)
+                    rewritten.add(name)
+                    continue
+                content, size = encoded
+                # the update keeps the rowid, so the order of the keys
+                if not self._connection.execute('UPDATE cache_nodes SET data = ? WHERE node = ? AND key = ?',
+                                                 (content, name, '.' + key)).rowcount:
+                    self._connection.execute('INSERT INTO cache_nodes VALUES (?, ?, ?)', (name, '.' + key, content))
+                self.bytes_written += size
+
+            for name in emptied:
+                if self._connection.execute('SELECT 1 FROM cache_nodes WHERE node = ? LIMIT 1', (name, )).fetchone():
+                    continue
+                content, size = self._encode({})
+                self._connection.execute('INSERT INTO cache_nodes VALUES (?, ?, ?)', (name, self.node_key, content))
+                self.bytes_written += size
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SQLiteCacheHub(FileCacheHub):
+    """FileCacheHub stores the nodes in an SQLite database, for caches with lots of nodes or keys
+
+    The usage is the same as the FileCacheHub, the root data must be a dict (so the SimpleCache cannot use it).
+    Every delayed flush writes the changed nodes in one transaction, and in lazy mode the nodes are read by point
+    queries at their first use.
+
+    Args:
+        db_path (str): path of the database file
+        write_delay_timeout (float): see FileCacheHub
+        lazy (bool): load the nodes at the first request
+        split_mappings (bool): see SQLiteStorage
+        serializer (CacheSerializer): see SQLiteStorage
+        stats_callback (callable): see FileCacheHub
+        write_max_delay (float): see FileCacheHub
+        loop (asyncio.AbstractEventLoop): see FileCacheHub
+        allowed_formats (iterable): see FileCacheHub
+    """
+
+    def __init__(self, db_path: str, write_delay_timeout: float = 1, lazy = True, split_mappings = False,
+                 serializer: CacheSerializer = None, stats_callback: callable = None, write_max_delay: float = None,
+                 loop = None, allowed_formats = None):
+        self._split_mappings = split_mappings
+        super(SQLiteCacheHub, self).__init__(db_path, write_delay_timeout, lazy = lazy, serializer = serializer,
+                                             stats_callback = stats_callback, write_max_delay = write_max_delay,
+                                             loop = loop, allowed_formats = allowed_formats)
+
+    def _create_storage(self, lazy, serializer, allowed_formats, **kwargs):
+        return SQLiteStorage(self._cache_file_path, self._split_mappings, serializer, allowed_formats)
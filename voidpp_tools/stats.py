@@ -0,0 +1,66 @@
+from bisect import bisect_left
+from threading import Lock
+
+class Histogram(object):
+    """Fixed bucket histogram with O(1) memory and O(log buckets) add, for latencies and sizes
+
+    The percentiles are approximated by the upper bound of the bucket they fall in.
+
+    Args:
+        bounds (list): sorted upper bounds of the buckets, the values above the last one go to an overflow bucket
+    """
+
+    # 100us ... ~105s in power of 2 steps
+    default_bounds = [0.0001 * 2 ** i for i in range(21)]
+
+    def __init__(self, bounds: list = None):
+        self._bounds = bounds or self.default_bounds
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._buckets = [0] * (len(self._bounds) + 1)
+            self.count = 0
+            self.sum = 0
+            self.min = None
+            self.max = None
+
+    def add(self, value):
+        with self._lock:
+            self._buckets[bisect_left(self._bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent: float):
+        """
+        Args:
+            percent (float): 0-100
+
+        Returns:
+            the upper bound of the bucket of the percentile (the max for the overflow bucket), None if empty
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = self.count * percent / 100.
+            seen = 0
+            for index, count in enumerate(self._buckets):
+                seen += count
+                if count and seen >= rank:
+                    return self._bounds[index] if index < len(self._bounds) else self.max
+            return self.max
+
+    def as_dict(self):
+        return dict(
+            count = self.count,
+            sum = self.sum,
+            min = self.min,
+            max = self.max,
+            mean = self.sum / self.count if self.count else None,
+            p50 = self.percentile(50),
+            p90 = self.percentile(90),
+            p99 = self.percentile(99),
+        )
@@ -1,30 +1,178 @@
-from threading import Thread, Event
+import os
+import time
+import atexit
+import heapq
+import asyncio
 import logging
+import weakref
+from itertools import count
+from datetime import datetime, timedelta
+from concurrent.futures import Future
+from threading import Thread, Event, Condition, Lock
+from .stats import Histogram
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 logger = logging.getLogger(__name__)
 
-class RunnerThread(Thread):
-    def __init__(self, callback):
-        super(RunnerThread, self).__init__()
-        self.__callback = callback
+def default_pool_size():
+    """Default number of the workers of a DaemonThreadPool, like at the ThreadPoolExecutor of python 3.8"""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class DaemonThreadPool(object):
+    """Minimal executor with daemon threads: unlike the ThreadPoolExecutor, the interpreter does not wait for the
+    running tasks at exit, unless the pool is shut down (see the DeadlineScheduler). The threads are started on demand,
+    and in a forked child the pool starts new threads.
+
+    Args:
+        max_workers (int): default is default_pool_size()
+        name (str): prefix of the thread names
+    """
+
+    def __init__(self, max_workers: int = None, name = 'DaemonThreadPool'):
+        self._max_workers = max_workers or default_pool_size()
+        self._name = name
+        self._lock = Lock()
+        self._shutdown = False
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = Queue()
+        self._threads = []
+        self._idle = 0
+
+    def submit(self, callback: callable, *args, **kwargs):
+        """
+        Returns:
+            concurrent.futures.Future:
+
+        Raises:
+            RuntimeError: the pool is shut down
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit new tasks after shutdown")
+            if self._pid != os.getpid():
+                # the threads do not exist in a forked child
+                self._reset()
+            self._queue.put((future, callback, args, kwargs))
+            if self._idle == 0 and len(self._threads) < self._max_workers:
+                thread = Thread(target = self._work, name = '{}-{}'.format(self._name, len(self._threads) + 1))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            else:
+                self._idle -= 1
+        return future
+
+    def shutdown(self, wait = True):
+        """Refuse the new tasks, the queued ones still run
+
+        Args:
+            wait (bool): wait for the queued and the running tasks
+        """
+        with self._lock:
+            self._shutdown = True
+            threads = self._threads if self._pid == os.getpid() else []
+            for _ in threads:
+                self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _work(self):
+        queue = self._queue
+        while True:
+            task = queue.get()
+            if task is None:
+                return
+            future, callback, args, kwargs = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = callback(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self._lock:
+                self._idle += 1
+
+_timer_executor = None
+_timer_executor_lock = Lock()
+
+def get_timer_executor():
+    """The process-wide DaemonThreadPool of the Timer callbacks, separated from the pool of the DeadlineScheduler"""
+    global _timer_executor
+    with _timer_executor_lock:
+        if _timer_executor is None:
+            _timer_executor = DaemonThreadPool(name = 'Timer')
+        return _timer_executor
 
-    def run(self):
-        try:
-            self.__callback()
-        except:
-            logger.exception("Error occured during timer callback run")
 
 class Timer(Thread):
     """
     Simple repeating timer.
+
+    The callback runs on an executor (by default on the daemon threads of get_timer_executor()), not in the timer
+    thread. If the callback is slower than the interval, at most max_concurrent runs are in progress, and
+    the further ticks are handled by the overrun policy:
+        - Timer.SKIP: the tick is skipped
+        - Timer.QUEUE: at most one run is queued, it starts right after a running one finished
+
+    The ticks are scheduled to absolute time.monotonic() deadlines (start + n * interval), so the period does not
+    drift. If the timer thread was late more than an interval, the missed ticks are handled by the catch up policy:
+        - Timer.CATCH_UP_SKIP: the missed ticks are dropped, the next tick keeps the original phase
+        - Timer.CATCH_UP_ALL: every missed tick fires immediately
+        - Timer.CATCH_UP_RESET: the schedule restarts from the late tick
+
+    Args:
+        interval (float): seconds
+        callback (callable):
+        overrun (str): Timer.SKIP or Timer.QUEUE
+        max_concurrent (int): maximum number of the parallel callback runs
+        executor (concurrent.futures.Executor):
+        catch_up (str): Timer.CATCH_UP_SKIP, Timer.CATCH_UP_ALL or Timer.CATCH_UP_RESET
     """
-    def __init__(self, interval, callback):
+
+    SKIP = 'skip'
+    QUEUE = 'queue'
+
+    CATCH_UP_SKIP = 'skip'
+    CATCH_UP_ALL = 'all'
+    CATCH_UP_RESET = 'reset'
+
+    def __init__(self, interval, callback, overrun = SKIP, max_concurrent = 1, executor = None,
+                 catch_up = CATCH_UP_SKIP):
         super(Timer, self).__init__()
 
+        if overrun not in (self.SKIP, self.QUEUE):
+            raise ValueError("Unknown overrun policy: {}".format(overrun))
+        if catch_up not in (self.CATCH_UP_SKIP, self.CATCH_UP_ALL, self.CATCH_UP_RESET):
+            raise ValueError("Unknown catch up policy: {}".format(catch_up))
+
         self.interval_event = Event()
         self.main_event = Event()
         self.interval = interval
         self.callback = callback
+        self.overrun = overrun
+        self.max_concurrent = max_concurrent
+        self.executor = executor
+        self.catch_up = catch_up
+
+        self.overrun_count = 0
+        self.missed_count = 0
+        self.exception_count = 0
+        self.jitter = Histogram()
+        self.durations = Histogram()
+        self._running = 0
+        self._queued = False
+        self._run_lock = Lock()
 
         self.daemon = True # stop if the program exits
 
@@ -33,10 +181,74 @@ class Timer(Thread):
 
     def run(self):
         while self.main_event.wait():
-            while not self.interval_event.wait(self.interval):
-                runner = RunnerThread(self.callback)
-                runner.setDaemon(True)
-                runner.start()
+            deadline = time.monotonic() + self.interval
+            while not self.interval_event.wait(max(0, deadline - time.monotonic())):
+                now = time.monotonic()
+                self.jitter.add(now - deadline)
+                self._tick()
+                deadline = self._next_deadline(deadline, now)
+
+    def _next_deadline(self, deadline, now):
+        deadline += self.interval
+        if deadline > now or self.catch_up == self.CATCH_UP_ALL:
+            return deadline
+        if self.catch_up == self.CATCH_UP_RESET:
+            self.missed_count += 1
+            return now + self.interval
+        missed = int((now - deadline) // self.interval) + 1
+        self.missed_count += missed
+        return deadline + missed * self.interval
+
+    def stats(self):
+        """
+        Returns:
+            dict:
+                jitter: histogram of the tick delays in seconds (see stats.Histogram.as_dict)
+                duration: histogram of the callback durations in seconds
+                overrun_count: ticks skipped or queued because of the running callbacks
+                missed_count: ticks dropped by the catch up policy
+                exception_count: callback runs raised exception
+        """
+        return dict(
+            jitter = self.jitter.as_dict(),
+            duration = self.durations.as_dict(),
+            overrun_count = self.overrun_count,
+            missed_count = self.missed_count,
+            exception_count = self.exception_count,
+        )
+
+    def _tick(self):
+        with self._run_lock:
+            if self._running < self.max_concurrent:
+                self._running += 1
+            else:
+                self.overrun_count += 1
+                if self.overrun == self.QUEUE:
+                    self._queued = True
+                return
+
+        try:
+            (self.executor or get_timer_executor()).submit(self._run_callback)
+        except RuntimeError:
+            # the pool is shut down at the interpreter exit
+            with self._run_lock:
+                self._running -= 1
+
+    def _run_callback(self):
+        while True:
+            start = time.monotonic()
+            try:
+                self.callback()
+            except:
+                self.exception_count += 1
+                logger.exception("Error occured during timer callback run")
+            self.durations.add(time.monotonic() - start)
+
+            with self._run_lock:
+                if not self._queued:
+                    self._running -= 1
+                    return
+                self._queued = False
 
     def start(self, interval = None):
         if interval is not None:
@@ -48,4 +260,480 @@ class Timer(Thread):
         return not self.interval_event.is_set()
 
     def stop(self):
+        # without clearing the main event the stopped timer thread would spin
+        self.main_event.clear()
         self.interval_event.set()
+
+
+class ScheduledCall(object):
+    """Handle of a callback in a DeadlineScheduler, can be (re)scheduled any number of times
+
+    Created by DeadlineScheduler.create
+    """
+
+    def __init__(self, scheduler, callback, args):
+        self._scheduler = scheduler
+        self.callback = callback
+        self.args = args
+        self.deadline = None
+        # the heap entries with an other version are outdated
+        self._version = 0
+
+    @property
+    def scheduled(self):
+        return self.deadline is not None
+
+    def schedule(self, deadline: float):
+        """Run the callback at the deadline (time.monotonic() based), replaces the previous deadline"""
+        self._scheduler._schedule(self, deadline)
+
+    def schedule_later(self, delay: float):
+        self.schedule(time.monotonic() + delay)
+
+    def cancel(self):
+        """
+        Returns:
+            bool: True if it was scheduled
+        """
+        return self._scheduler._cancel(self)
+
+    def _run(self):
+        try:
+            self.callback(*self.args)
+        except:
+            logger.exception("Error occured during scheduled callback run")
+
+
+class DeadlineScheduler(object):
+    """One thread with a heap of deadlines, the callbacks run on a bounded DaemonThreadPool
+
+    Rescheduling a call is O(log n) and does not create any thread. The outdated heap entries are dropped lazily.
+    After fork the scheduler starts a new thread and pool in the child, so the calls created before keep working, but
+    the calls scheduled in the parent are dropped (they run in the parent), only the ones scheduled in the child run.
+    At the interpreter exit the pool is shut down, the running callbacks (eg the cache flushes) are waited for.
+
+    Args:
+        max_workers (int): size of the thread pool, default is default_pool_size()
+    """
+
+    def __init__(self, max_workers: int = None):
+        self._max_workers = max_workers
+        self._heap = []
+        self._scheduled = 0
+        self._condition = Condition(Lock())
+        self._counter = count()
+        self._thread = None
+        self._executor = DaemonThreadPool(max_workers, 'DeadlineScheduler')
+        self._pid = os.getpid()
+        _schedulers.add(self)
+
+    def _after_fork(self):
+        # only the forking thread exists in the child, the locks may be held by the lost threads
+        self._pid = os.getpid()
+        self._condition = Condition(Lock())
+        self._thread = None
+        for deadline, _, version, call in self._heap:
+            if version == call._version:
+                call._version += 1
+                call.deadline = None
+        self._heap = []
+        self._scheduled = 0
+        self._executor = DaemonThreadPool(self._max_workers, 'DeadlineScheduler')
+
+    @property
+    def executor(self):
+        return self._executor
+
+    def create(self, callback: callable, *args):
+        """Create a not scheduled call"""
+        return ScheduledCall(self, callback, args)
+
+    def call_at(self, deadline: float, callback: callable, *args):
+        call = self.create(callback, *args)
+        call.schedule(deadline)
+        return call
+
+    def call_later(self, delay: float, callback: callable, *args):
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def submit(self, callback: callable, *args):
+        """Run the callback in the thread pool as soon as possible"""
+        if self._pid != os.getpid():
+            self._after_fork()
+        try:
+            return self._executor.submit(callback, *args)
+        except RuntimeError:
+            # the pool is shut down at the interpreter exit (see _shutdown_schedulers)
+            callback(*args)
+
+    def _schedule(self, call: ScheduledCall, deadline: float):
+        if self._pid != os.getpid():
+            self._after_fork()
+        with self._condition:
+            if call.deadline is None:
+                self._scheduled += 1
+            call._version += 1
+            call.deadline = deadline
+            heapq.heappush(self._heap, (deadline, next(self._counter), call._version, call))
+
+            # too many outdated entries
+            if len(self._heap) > 2 * self._scheduled + 64:
+                self._heap = [entry for entry in self._heap if entry[2] == entry[3]._version]
+                heapq.heapify(self._heap)
+
+            if self._thread is None:
+                self._thread = Thread(target = self._run, name = 'DeadlineScheduler')
+                self._thread.daemon = True
+                self._thread.start()
+
+            if self._heap[0][3] is call:
+                self._condition.notify()
+
+    def _cancel(self, call: ScheduledCall):
+        with self._condition:
+            if call.deadline is None:
+                return False
+            self._scheduled -= 1
+            call._version += 1
+            call.deadline = None
+            return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, _, version, call = self._heap[0]
+                if version != call._version:
+                    heapq.heappop(self._heap)
+                    continue
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                self._scheduled -= 1
+                call._version += 1
+                call.deadline = None
+            self.submit(call._run)
+
+    @property
+    def scheduled_count(self):
+        """Number of the scheduled calls"""
+        return self._scheduled
+
+
+_schedulers = weakref.WeakSet()
+
+def _reset_schedulers_after_fork():
+    for scheduler in list(_schedulers):
+        scheduler._after_fork()
+
+# the pid check of the scheduler methods covers the older pythons
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child = _reset_schedulers_after_fork)
+
+@atexit.register
+def _shutdown_schedulers():
+    for scheduler in list(_schedulers):
+        if scheduler._pid == os.getpid():
+            scheduler.executor.shutdown()
+
+_default_scheduler = None
+_default_scheduler_lock = Lock()
+
+def get_default_scheduler():
+    """The process-wide DeadlineScheduler, it keeps working after fork (see DeadlineScheduler)"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = DeadlineScheduler()
+        return _default_scheduler
+
+def get_scheduler(scheduler: DeadlineScheduler = None):
+    """The given scheduler, or the process-wide one if it is None"""
+    return get_default_scheduler() if scheduler is None else scheduler
+
+
+class CronExpression(object):
+    """Standard 5 field cron expression: minute hour day-of-month month day-of-week
+
+    The fields support '*', lists ('1,5'), ranges ('1-5') and steps ('*/15', '10-40/10'). The day of week is 0-7,
+    both 0 and 7 is Sunday. If both the day of month and the day of week are restricted, any of them matches
+    (like in cron).
+
+    Args:
+        expression (str): eg '*/5 * * * *'
+    """
+
+    limits = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("Cron expression must have 5 fields: '{}'".format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.limits)]
+        self.weekdays = set(day % 7 for day in weekdays)
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for item in field.split(','):
+            range_part, _, step = item.partition('/')
+            if range_part == '*':
+                start, end = low, high
+            elif '-' in range_part:
+                start, end = [int(value) for value in range_part.split('-', 1)]
+            else:
+                start = int(range_part)
+                end = high if step else start
+            if start < low or end > high or start > end:
+                raise ValueError("Invalid cron field: '{}'".format(field))
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, date):
+        day = date.day in self.days
+        weekday = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_time(self, after: datetime):
+        """The first matching minute after the given time"""
+        moment = after.replace(second = 0, microsecond = 0) + timedelta(minutes = 1)
+        # about 10 years in the worst case, eg '0 0 29 2 1'
+        for _ in range(100000):
+            if moment.month not in self.months:
+                moment = (moment.replace(day = 1, hour = 0, minute = 0) + timedelta(days = 32)).replace(day = 1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour = 0, minute = 0) + timedelta(days = 1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute = 0) + timedelta(hours = 1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes = 1)
+            else:
+                return moment
+        raise ValueError("Cron expression never matches: '{}'".format(self.expression))
+
+
+class SchedulerJob(object):
+    """Base class of the Scheduler jobs, they have the same start/stop/is_running interface as the Timer
+
+    If the previous run of the callback is still in progress at a tick, the tick is skipped (and counted in the
+    overrun_count).
+    """
+
+    def __init__(self, scheduler: DeadlineScheduler, callback: callable):
+        self.callback = callback
+        self.overrun_count = 0
+        self.exception_count = 0
+        self._call = scheduler.create(self._fire)
+        self._running = False
+        self._run_lock = Lock()
+        self._deadline = None
+
+    def _next_deadline(self, now):
+        raise NotImplementedError()
+
+    def _fire(self):
+        if not self._running:
+            return
+        # schedule the next tick first, so the callback duration does not shift it
+        self._deadline = self._next_deadline(time.monotonic())
+        self._call.schedule(self._deadline)
+
+        if not self._run_lock.acquire(False):
+            self.overrun_count += 1
+            return
+        try:
+            self.callback()
+        except:
+            self.exception_count += 1
+            logger.exception("Error occured during scheduled job run")
+        finally:
+            self._run_lock.release()
+
+    @property
+    def next_run(self):
+        """The time.monotonic() deadline of the next run, None if not running"""
+        return self._deadline if self._running else None
+
+    def start(self):
+        self._running = True
+        self._deadline = None # the restarted interval jobs start a new phase
+        self._deadline = self._next_deadline(time.monotonic())
+        self._call.schedule(self._deadline)
+
+    def is_running(self):
+        return self._running
+
+    def stop(self):
+        self._running = False
+        self._call.cancel()
+
+
+class IntervalJob(SchedulerJob):
+    """Runs the callback in every interval seconds, on absolute deadlines (the missed ticks are skipped)"""
+
+    def __init__(self, scheduler: DeadlineScheduler, interval: float, callback: callable):
+        super(IntervalJob, self).__init__(scheduler, callback)
+        self.interval = interval
+
+    def _next_deadline(self, now):
+        if self._deadline is None:
+            return now + self.interval
+        deadline = self._deadline + self.interval
+        if deadline <= now:
+            deadline += ((now - deadline) // self.interval + 1) * self.interval
+        return deadline
+
+    def start(self, interval: float = None):
+        if interval is not None:
+            self.interval = interval
+        super(IntervalJob, self).start()
+
+
+class CronJob(SchedulerJob):
+    """Runs the callback at the times matched by a cron expression (local wall clock time)"""
+
+    def __init__(self, scheduler: DeadlineScheduler, expression: str, callback: callable):
+        super(CronJob, self).__init__(scheduler, callback)
+        self.expression = CronExpression(expression)
+
+    def _next_deadline(self, now):
+        wall_now = datetime.now()
+        return now + (self.expression.next_time(wall_now) - wall_now).total_seconds()
+
+
+class Scheduler(object):
+    """Runs lots of periodic jobs with one thread and a shared thread pool
+
+    The jobs are kept in the heap of a DeadlineScheduler, so adding, removing and rescheduling a job is O(log n).
+
+    Args:
+        deadline_scheduler (DeadlineScheduler): default is the process-wide one (see get_default_scheduler)
+
+    Example:
+        from voidpp_tools.timer import Scheduler
+
+        scheduler = Scheduler()
+        job = scheduler.every(10, refresh_status)
+        scheduler.cron('0 3 * * *', cleanup)
+
+        job.stop()
+    """
+
+    def __init__(self, deadline_scheduler: DeadlineScheduler = None):
+        self._deadline_scheduler = get_scheduler(deadline_scheduler)
+        self._jobs = set()
+        self._lock = Lock()
+
+    @property
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def add(self, job: SchedulerJob, start = True):
+        with self._lock:
+            self._jobs.add(job)
+        if start:
+            job.start()
+        return job
+
+    def every(self, interval: float, callback: callable, start = True):
+        """Add an IntervalJob"""
+        return self.add(IntervalJob(self._deadline_scheduler, interval, callback), start)
+
+    def cron(self, expression: str, callback: callable, start = True):
+        """Add a CronJob"""
+        return self.add(CronJob(self._deadline_scheduler, expression, callback), start)
+
+    def remove(self, job: SchedulerJob):
+        job.stop()
+        with self._lock:
+            self._jobs.discard(job)
+
+    def stop(self):
+        """Stop and remove all jobs"""
+        for job in self.jobs:
+            self.remove(job)
+
+
+def _log_task_exception(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Error occured during async callback run", exc_info = task.exception())
+
+def call_in_loop(loop, callback: callable):
+    """Call a sync or a coroutine function in the event loop thread
+
+    Returns:
+        the asyncio.Task of the coroutine or None for the sync functions
+    """
+    try:
+        result = callback()
+    except Exception:
+        logger.exception("Error occured during async callback run")
+        return None
+    if asyncio.iscoroutine(result):
+        task = loop.create_task(result)
+        task.add_done_callback(_log_task_exception)
+        return task
+    return None
+
+
+class AsyncTimer(object):
+    """Repeating timer for asyncio, based on loop.call_at without any thread
+
+    The callback can be a sync function (called in the loop) or a coroutine function (started as a task). The ticks
+    are scheduled like in the Timer (absolute deadlines, missed ticks dropped), and a tick is skipped if the task of
+    the previous tick is still running. The methods must be called from the event loop thread.
+
+    Args:
+        interval (float): seconds
+        callback (callable): sync or coroutine function
+        loop (asyncio.AbstractEventLoop): default is the event loop of the start() caller
+    """
+
+    def __init__(self, interval: float, callback: callable, loop = None):
+        self.interval = interval
+        self.callback = callback
+        self.overrun_count = 0
+        self._loop = loop
+        self._handle = None
+        self._deadline = None
+        self._task = None
+
+    def _tick(self):
+        now = self._loop.time()
+        self._deadline += self.interval
+        if self._deadline <= now:
+            self._deadline += ((now - self._deadline) // self.interval + 1) * self.interval
+        self._handle = self._loop.call_at(self._deadline, self._tick)
+
+        if self._task is not None and not self._task.done():
+            self.overrun_count += 1
+            return
+        self._task = call_in_loop(self._loop, self.callback)
+
+    def start(self, interval: float = None):
+        if interval is not None:
+            self.interval = interval
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self.stop()
+        self._deadline = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._deadline, self._tick)
+
+    def is_running(self):
+        return self._handle is not None
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None